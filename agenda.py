@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""agenda.py
+
+Udacity conference server-side Python App Engine agenda import parsing
+
+Turns an uploaded agenda, CSV with a header row or a JSON list of
+objects, into SessionForms. Columns/keys are SessionForm field names;
+unknown ones are ignored. Forms are stored between import steps as
+newline-delimited protojson.
+
+"""
+
+import csv
+import json
+from cStringIO import StringIO
+
+import endpoints
+from protorpc import messages
+from protorpc import protojson
+
+from models import SessionForm
+
+FORMATS = ('csv', 'json')
+_FIELDS = [f for f in SessionForm.all_fields() if f.name != 'websafeKey']
+
+
+def _formFromRow(row):
+    """Build a SessionForm from a dict of field name to raw value."""
+    form = SessionForm()
+    for field in _FIELDS:
+        value = row.get(field.name)
+        if value is None or value == '':
+            continue
+        if isinstance(field, messages.IntegerField):
+            value = int(value)
+        elif isinstance(field, messages.EnumField):
+            value = field.type(str(value))
+        else:
+            value = value if isinstance(value, unicode) else \
+                unicode(str(value), 'utf-8')
+        setattr(form, field.name, value)
+    return form
+
+
+def _csvRows(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    for row in csv.DictReader(StringIO(data)):
+        yield dict((name.strip(), value.decode('utf-8'))
+                   for name, value in row.items()
+                   if name and value is not None)
+
+
+def _jsonRows(data):
+    rows = json.loads(data)
+    if not isinstance(rows, list):
+        raise ValueError('a JSON agenda must be a list of sessions')
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError('each session must be a JSON object')
+        yield row
+
+
+def parse(data, fmt, validate, maxRows):
+    """Return the SessionForms of an agenda and a list of error strings.
+
+    validate(form) is called on every form and may raise to reject the
+    row. Rows are numbered from 1, not counting a CSV header.
+    """
+    if fmt not in FORMATS:
+        return [], ['format must be one of %s' % ', '.join(FORMATS)]
+    forms, errors = [], []
+    try:
+        rows = _csvRows(data) if fmt == 'csv' else _jsonRows(data)
+        for number, row in enumerate(rows, 1):
+            if number > maxRows:
+                errors.append('more than %d rows' % maxRows)
+                break
+            try:
+                form = _formFromRow(row)
+                validate(form)
+                forms.append(form)
+            except (ValueError, TypeError, messages.ValidationError,
+                    endpoints.ServiceException) as e:
+                errors.append('row %d: %s' % (number, e))
+    except (ValueError, csv.Error) as e:
+        errors.append(str(e))
+    return forms, errors
+
+
+def dumps(forms):
+    """Encode SessionForms as newline-delimited protojson."""
+    return '\n'.join(protojson.encode_message(form) for form in forms)
+
+
+def loads(data):
+    """Decode SessionForms encoded by dumps()."""
+    return [protojson.decode_message(SessionForm, line)
+            for line in data.splitlines() if line]
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+"""endpoints_bench.py
+
+Benchmark ConferenceApi methods on the App Engine testbed stubs
+(datastore_v3, memcache, taskqueue, urlfetch).
+
+For each data size the datastore is seeded with Profiles, Conferences
+(with seat shards) and Sessions, then every scenario below is driven for
+a number of calls. Each result records mean wall time per call, RPCs per
+call by service and the memcache hit rate, and everything is written out
+as JSON so two releases can be diffed.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python benchmarks/endpoints_bench.py --sizes 100,1000 --output out.json
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+import fulltext
+import seats
+import speakers
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import Profile
+from models import Session
+from models import SessionSpeakerQueryForm
+
+BENCH_USER = 'bench@example.com'
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago', 'Berlin']
+TOPICS = ['Web', 'Cloud', 'Medical Innovations', 'Programming Languages']
+SPEAKERS = ['Speaker %d' % i for i in range(40)]
+
+
+class RpcCounter(object):
+    """Counts API calls by service through an apiproxy pre-call hook."""
+
+    def __init__(self):
+        self.calls = Counter()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'bench_rpc_counter', self._hook)
+
+    def _hook(self, service, call, request, response):
+        self.calls[service] += 1
+
+    def reset(self):
+        self.calls.clear()
+
+
+def setUpTestbed():
+    """Activate the stubs and sign in BENCH_USER for endpoints."""
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=os.path.join(
+        os.path.dirname(__file__), '..'))
+    tb.init_urlfetch_stub()
+    tb.init_search_stub()
+    tb.init_user_stub()
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = BENCH_USER
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+    return tb
+
+
+def seed(size, sessionsPerConference):
+    """Create size conferences (and their organizers and sessions);
+    returns the websafe keys of the conferences.
+    """
+    rnd = random.Random(size)
+    organizers = [Profile(key=ndb.Key(Profile, 'organizer%d@example.com' % i),
+                          displayName='Organizer %d' % i,
+                          mainEmail='organizer%d@example.com' % i)
+                  for i in range(max(1, size // 10))]
+    organizers.append(Profile(key=ndb.Key(Profile, BENCH_USER),
+                              displayName='Bench', mainEmail=BENCH_USER))
+    ndb.put_multi(organizers)
+
+    today = date.today()
+    confs, shards, sessions = [], [], []
+    for i in range(size):
+        org = organizers[-1] if i == 0 else rnd.choice(organizers[:-1])
+        start = today + timedelta(days=rnd.randint(-400, 400))
+        maxAttendees = rnd.choice([10, 50, 100, 500])
+        conf = Conference(
+            key=ndb.Key(Conference, i + 1, parent=org.key),
+            name='Conference %d' % i, description='Benchmark conference',
+            organizerUserId=org.key.id(),
+            organizerDisplayName=org.displayName,
+            topics=rnd.sample(TOPICS, 2), city=rnd.choice(CITIES),
+            startDate=start, endDate=start + timedelta(days=2),
+            month=start.month, maxAttendees=maxAttendees,
+            seatsAvailable=maxAttendees)
+        shards.extend(seats.createShards(conf, maxAttendees))
+        confs.append(conf)
+        for j in range(sessionsPerConference):
+            sessions.append(Session(
+                # string ids, so createSession's allocated ids can't clash
+                key=ndb.Key(Session, 's%d' % j, parent=conf.key),
+                name='Session %d.%d' % (i, j), highlights='Benchmark',
+                speaker=rnd.choice(SPEAKERS), duration=60,
+                typeOfSession=rnd.choice(['Lecture', 'Keynote', 'Workshop']),
+                date=start))
+    for batch in range(0, len(confs + shards + sessions), 500):
+        ndb.put_multi((confs + shards + sessions)[batch:batch + 500])
+    speakers.indexSessions(sessions)
+    fulltext.indexConferences(confs)
+    fulltext.indexSessions(sessions)
+    return [conf.key.urlsafe() for conf in confs]
+
+
+def scenarios(wscks):
+    """Return [(name, function(api, i))] driving one call each."""
+    own = wscks[0]      # conference organized by BENCH_USER
+    getReq = conference.CONF_GET_REQUEST.combined_message_class
+    condReq = conference.CONF_CONDITIONAL_GET_REQUEST.combined_message_class
+    sessReq = conference.SESS_GET_REQUEST.combined_message_class
+    postReq = conference.SESS_POST_REQUEST.combined_message_class
+    pageReq = conference.PAGE_GET_REQUEST.combined_message_class
+    ongoingReq = conference.CONF_ONGOING_GET_REQUEST.combined_message_class
+    wishReq = conference.SESS_WISHLIST_POST_REQUEST.combined_message_class
+    confSearchReq = conference.CONF_SEARCH_REQUEST.combined_message_class
+    sessSearchReq = conference.SESS_SEARCH_REQUEST.combined_message_class
+
+    def pick(i):
+        return wscks[i % len(wscks)]
+
+    def register(api, i):
+        api._conferenceRegistration(getReq(websafeConferenceKey=pick(i)))
+
+    def unregister(api, i):
+        api._conferenceRegistration(getReq(websafeConferenceKey=pick(i)),
+                                    reg=False)
+
+    seen = {}
+
+    def getConferenceIfNoneMatch(api, i):
+        # the first call per conference fetches it in full for its ETag
+        wsck = pick(i)
+        form = api.getConference(condReq(websafeConferenceKey=wsck,
+                                         ifNoneMatch=seen.get(wsck)))
+        seen[wsck] = form.etag
+
+    def addToWishlist(api, i):
+        sessions = Session.query(ancestor=ndb.Key(urlsafe=pick(i))).fetch(
+            1, keys_only=True)
+        if sessions:
+            api.addSessionToWishlist(
+                wishReq(websafeSessionKey=sessions[0].urlsafe()))
+
+    return [
+        ('queryConferences', lambda api, i: api.queryConferences(
+            ConferenceQueryForms(filters=[ConferenceQueryForm(
+                field='CITY', operator='EQ', value=CITIES[i % 5])]))),
+        ('queryConferences[multi-inequality]',
+         lambda api, i: api.queryConferences(ConferenceQueryForms(filters=[
+             ConferenceQueryForm(field='MONTH', operator='GT', value='5'),
+             ConferenceQueryForm(field='MAX_ATTENDEES', operator='LT',
+                                 value='100')]))),
+        ('getConference', lambda api, i: api.getConference(
+            condReq(websafeConferenceKey=pick(i)))),
+        ('getConference[ifNoneMatch]', getConferenceIfNoneMatch),
+        ('getConferenceSessions', lambda api, i: api.getConferenceSessions(
+            sessReq(websafeConferenceKey=pick(i)))),
+        ('getOngoingConferences', lambda api, i: api.getOngoingConferences(
+            ongoingReq())),
+        ('registerForConference', register),
+        ('getConferencesToAttend', lambda api, i: api.getConferencesToAttend(
+            pageReq())),
+        ('unregisterFromConference', unregister),
+        ('addSessionToWishlist', addToWishlist),
+        ('getSessionsInWishlist', lambda api, i: api.getSessionsInWishlist(
+            pageReq())),
+        ('getSessionsBySpeaker', lambda api, i: api.getSessionsBySpeaker(
+            SessionSpeakerQueryForm(speaker=SPEAKERS[i % len(SPEAKERS)]))),
+        ('searchConferences', lambda api, i: api.searchConferences(
+            confSearchReq(query='conf %d' % i))),
+        ('searchSessions', lambda api, i: api.searchSessions(
+            sessSearchReq(query=SPEAKERS[i % len(SPEAKERS)][:4]))),
+        ('getFeaturedSpeaker', lambda api, i: api.getFeaturedSpeaker(
+            getReq(websafeConferenceKey=pick(i)))),
+        ('createSession', lambda api, i: api.createSession(postReq(
+            websafeConferenceKey=own, name='Bench %d' % i,
+            speaker=SPEAKERS[i % 3], duration=30))),
+    ]
+
+
+def run(size, calls, sessionsPerConference):
+    """Seed one data size and drive every scenario; returns results."""
+    tb = setUpTestbed()
+    try:
+        counter = RpcCounter()
+        wscks = seed(size, sessionsPerConference)
+        results = []
+        for name, call in scenarios(wscks):
+            counter.reset()
+            memcache.flush_all()
+            before = memcache.get_stats()
+            elapsed = 0.0
+            errors = 0
+            for i in range(calls):
+                # each call stands for a fresh request: no cached
+                # entities, and a new API instance with its own
+                # RequestContext (user, user id and Profile)
+                ndb.get_context().clear_cache()
+                api = ConferenceApi()
+                start = time.time()
+                try:
+                    call(api, i)
+                except endpoints.ServiceException:
+                    # e.g. NotFound from an empty result; still timed
+                    errors += 1
+                elapsed += time.time() - start
+            after = memcache.get_stats() or {}
+            hits = after.get('hits', 0) - (before or {}).get('hits', 0)
+            misses = after.get('misses', 0) - (before or {}).get('misses', 0)
+            results.append({
+                'size': size,
+                'endpoint': name,
+                'calls': calls,
+                'errors': errors,
+                'wallMsPerCall': round(elapsed * 1000.0 / calls, 3),
+                'rpcsPerCall': dict((service, round(float(n) / calls, 2))
+                                    for service, n in counter.calls.items()),
+                'datastoreRpcsPerCall': round(
+                    float(counter.calls['datastore_v3']) / calls, 2),
+                'memcacheHitRate': (round(float(hits) / (hits + misses), 3)
+                                    if hits + misses else None),
+            })
+        return results
+    finally:
+        tb.deactivate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='100,1000,5000',
+                        help='comma separated conference counts')
+    parser.add_argument('--calls', type=int, default=20,
+                        help='calls per endpoint per size')
+    parser.add_argument('--sessions-per-conference', type=int, default=10)
+    parser.add_argument('--output', help='write JSON here, not stdout')
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        results.extend(run(size, args.calls, args.sessions_per_conference))
+        sys.stderr.write('size %d done\n' % size)
+
+    report = json.dumps({'sizes': args.sizes, 'calls': args.calls,
+                         'sessionsPerConference':
+                         args.sessions_per_conference,
+                         'results': results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
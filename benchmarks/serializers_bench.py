@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""serializers_bench.py
+
+Micro-benchmark: compiled serializers vs. the old reflective
+_copy*ToForm loops, on in-memory entity lists.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python benchmarks/serializers_bench.py [count]
+
+"""
+
+import os
+import sys
+import timeit
+from datetime import date
+from datetime import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.ext import ndb
+
+import serializers
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+from models import TypeOfSession
+
+APP = 'bench'
+
+
+def reflectiveConference(conf):
+    """The pre-serializers _copyConferenceToForm loop."""
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveSession(session):
+    """The pre-serializers _copySessionToForm loop."""
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name == 'typeOfSession':
+                setattr(sf, field.name,
+                        getattr(TypeOfSession, getattr(session, field.name)))
+            elif field.name == 'date' or field.name == 'startTime':
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+        elif field.name == "websafeKey":
+            setattr(sf, field.name, session.key.urlsafe())
+    return sf
+
+
+def makeConferences(count):
+    return [Conference(key=ndb.Key(Conference, i + 1, app=APP),
+                       name='Conference %d' % i, description='About %d' % i,
+                       organizerUserId='user%d' % (i % 50),
+                       organizerDisplayName='User %d' % (i % 50),
+                       topics=['Web', 'Cloud'], city='London',
+                       startDate=date(2016, 6, 1), endDate=date(2016, 6, 3),
+                       month=6, maxAttendees=100, seatsAvailable=50)
+            for i in range(count)]
+
+
+def makeSessions(count):
+    return [Session(key=ndb.Key(Session, i + 1, app=APP),
+                    name='Session %d' % i, highlights='Things',
+                    speaker='Speaker %d' % (i % 20), duration=60,
+                    typeOfSession='Lecture', date=date(2016, 6, 1),
+                    startTime=time(9 + i % 8, 0))
+            for i in range(count)]
+
+
+def bench(label, old, new, entities, repeat=3):
+    oldTime = min(timeit.repeat(lambda: [old(e) for e in entities],
+                                number=1, repeat=repeat))
+    newTime = min(timeit.repeat(lambda: new(entities),
+                                number=1, repeat=repeat))
+    print('%-12s %6d items  reflective %7.3fs  compiled %7.3fs  x%.1f' % (
+        label, len(entities), oldTime, newTime, oldTime / newTime))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bench('conferences', reflectiveConference,
+          serializers.CONFERENCE.toForms, makeConferences(count))
+    bench('sessions', reflectiveSession,
+          serializers.SESSION.toForms, makeSessions(count))
+
+
+if __name__ == '__main__':
+    main()
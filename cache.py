@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Udacity conference server-side Python App Engine read-through memcache
+for Conference and Session lookups
+
+Entries are stored under a per-conference version number. A write bumps
+the version (after it has committed), so a reader that raced the write
+can only have cached the old value under the old version, which nobody
+reads again. A conference's sessions share its version.
+
+"""
+
+import time
+from collections import Counter
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Session
+
+MEMCACHE_VERSION_KEY = "CONF_VERSION:%s"
+MEMCACHE_CONFERENCE_KEY = "CONF:%s:%s"
+MEMCACHE_SESSIONS_KEY = "CONF_SESSIONS:%s:%s"
+MEMCACHE_STATS_KEY = "CACHE_STATS:%s"
+CACHE_TTL = 3600            # seconds
+STATS_FLUSH_EVERY = 100     # local lookups between counter flushes
+
+_counters = Counter()
+
+
+def _record(hits, misses):
+    """Count hits/misses locally, flushing to memcache now and then."""
+    _counters['hits'] += hits
+    _counters['misses'] += misses
+    if _counters['hits'] + _counters['misses'] >= STATS_FLUSH_EVERY:
+        flushStats()
+
+
+def flushStats():
+    """Add this instance's hit/miss counts to the shared counters."""
+    pending = dict((MEMCACHE_STATS_KEY % name, n)
+                   for name, n in _counters.items() if n)
+    if pending:
+        memcache.offset_multi(pending, initial_value=0)
+    _counters.clear()
+
+
+def stats():
+    """Return {'hits', 'misses', 'hitRate'} across all instances."""
+    flushStats()
+    got = memcache.get_multi([MEMCACHE_STATS_KEY % name
+                              for name in ('hits', 'misses')])
+    hits = got.get(MEMCACHE_STATS_KEY % 'hits', 0)
+    misses = got.get(MEMCACHE_STATS_KEY % 'misses', 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses,
+            'hitRate': float(hits) / total if total else 0.0}
+
+
+def _versions(conf_keys):
+    """Return {conf_key: current version}, starting missing versions at
+    a fresh number so an evicted version is never reused.
+    """
+    vkeys = dict((MEMCACHE_VERSION_KEY % key.urlsafe(), key)
+                 for key in conf_keys)
+    got = memcache.get_multi(vkeys.keys())
+    missing = dict((vkey, int(time.time() * 1000))
+                   for vkey in vkeys if vkey not in got)
+    if missing:
+        lost = memcache.add_multi(missing, time=CACHE_TTL)
+        for vkey in lost:
+            del missing[vkey]
+        got.update(missing)
+        if lost:
+            got.update(memcache.get_multi(lost))
+    return dict((key, got.get(vkey, 0)) for vkey, key in vkeys.items())
+
+
+def invalidate(conf_key):
+    """Drop cached data for a conference and its sessions; call once the
+    write has committed.
+    """
+    memcache.incr(MEMCACHE_VERSION_KEY % conf_key.urlsafe(),
+                  initial_value=int(time.time() * 1000))
+
+
+def getConferences(conf_keys):
+    """Read-through get_multi of Conferences; None for missing ones."""
+    if not conf_keys:
+        return []
+    versions = _versions(conf_keys)
+    ckeys = dict((key, MEMCACHE_CONFERENCE_KEY % (key.urlsafe(),
+                                                  versions[key]))
+                 for key in conf_keys)
+    cached = memcache.get_multi(ckeys.values())
+    missing = [key for key in conf_keys if ckeys[key] not in cached]
+    _record(len(conf_keys) - len(missing), len(missing))
+
+    if missing:
+        fetched = ndb.get_multi(missing)
+        memcache.set_multi(dict((ckeys[conf.key], conf)
+                                for conf in fetched if conf),
+                           time=CACHE_TTL)
+        for key, conf in zip(missing, fetched):
+            cached[ckeys[key]] = conf
+    return [cached.get(ckeys[key]) for key in conf_keys]
+
+
+def getConference(conf_key):
+    """Read-through get of one Conference; None if it doesn't exist."""
+    return getConferences([conf_key])[0]
+
+
+def getConferenceSessions(conf_key):
+    """Read-through list of all Sessions of a conference."""
+    ckey = MEMCACHE_SESSIONS_KEY % (conf_key.urlsafe(),
+                                    _versions([conf_key])[conf_key])
+    sessions = memcache.get(ckey)
+    if sessions is not None:
+        _record(1, 0)
+        return sessions
+    _record(0, 1)
+    sessions = Session.query(ancestor=conf_key).fetch()
+    memcache.set(ckey, sessions, time=CACHE_TTL)
+    return sessions
@@ -12,8 +12,11 @@ wesc+api@google.com (Wesley Chun)'
 
 """
 
+import logging
+import time
 from datetime import datetime
 from datetime import date
+from collections import OrderedDict
 
 import endpoints
 from protorpc import messages
@@ -21,8 +24,10 @@ from protorpc import message_types
 from protorpc import remote
 
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import ConflictException
 from models import Profile
@@ -31,35 +36,88 @@ from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
+from models import Registration
+from models import RegistrationStatus
+from models import RegistrationTicket
+from models import RegistrationTicketForm
 from models import ConferenceForm
 from models import ConferenceForms
-from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
 from models import Session
 from models import SessionForm
 from models import SessionForms
-from models import TypeOfSession
 from models import SessionSpeakerQueryForm
 from models import SessionTypeQueryForm
 from models import SessionWishlistForm
 from models import SessionDateRangeQueryForm
 from models import FeaturedSpeakerQueryForm
 from models import SessionCreateReturnForm
+from models import SessionCreateReturnForms
+from models import AgendaImport
+from models import AgendaImportChunk
+from models import AgendaImportForm
+from models import AgendaImportStatusForm
+from models import SpeakerSessionCount
+from models import FeaturedSpeaker
+from models import NearlySoldOut
+from models import WishlistItem
+from models import WishlistUpdateForm
+from models import WishlistAddForm
+from models import WishlistConflictForm
+from models import WishlistConflictForms
+from models import WishlistSchedule
+from models import RESPONSE_ONLY_FIELDS
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
-
-from utils import getUserId
+from settings import QUERY_EXPLAIN
+
+from requestcontext import RequestContext
+
+import agenda
+import cache
+import etags
+import fulltext
+import instrument
+import planner
+import profiler
+import schedule
+import seats
+import serializers
+import speakers
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATUREDSPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_FEATUREDSPEAKER_KEY = "FEATURED_SPEAKER:%s"
+FEATURED_SPEAKER_ID = "featured"
+NEARLY_SOLD_OUT_ID = "nearly_sold_out"
+NEARLY_SOLD_OUT_SEATS = 5
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+ORGANIZER_UPDATE_BATCH_SIZE = 100
+REGISTRATION_MIGRATION_BATCH_SIZE = 100
+# one commit writes the sessions, a SpeakerSessionCount per speaker and
+# the FeaturedSpeaker: at most 2 * 200 + 1 of the datastore's 500
+MAX_SESSIONS_PER_BATCH = 200
+REINDEX_BATCH_SIZE = 100
+FEATURED_REBUILD_BATCH_SIZE = 20
+MAX_SPEAKER_INDEX_WRITES = 500     # puts and deletes, in one commit
+MAX_QUERY_SCAN = 1000
+MAX_WISHLIST_UPDATE = 100
+REGISTRATION_QUEUE = 'registrations'
+REGISTRATION_BATCH_SIZE = 100
+REGISTRATION_LEASE_SECONDS = 60
+REGISTRATION_DRAIN_DELAY = 2    # seconds that requests gather into a batch
+PENDING_TICKET_STATUSES = ('QUEUED', 'ALLOCATED')
+MAX_IMPORT_ROWS = 5000
+IMPORT_CHUNK_SIZE = 100
+MAX_IMPORT_ERRORS = 20
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -69,35 +127,51 @@ DEFAULTS = {
     "topics": ["Default", "Topic"],
 }
 
-OPERATORS = {
-            'EQ':   '=',
-            'GT':   '>',
-            'GTEQ': '>=',
-            'LT':   '<',
-            'LTEQ': '<=',
-            'NE':   '!='
-            }
-
-FIELDS = {
-         'CITY': 'city',
-         'TOPIC': 'topics',
-         'MONTH': 'month',
-         'MAX_ATTENDEES': 'maxAttendees',
-         }
-
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_CONDITIONAL_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+PROFILE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
+PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+)
+
+CONF_ONGOING_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    date=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+SESS_PREFERRED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
 )
 
 SESS_POST_REQUEST = endpoints.ResourceContainer(
@@ -105,6 +179,21 @@ SESS_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESS_BATCH_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+AGENDA_IMPORT_POST_REQUEST = endpoints.ResourceContainer(
+    AgendaImportForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+AGENDA_IMPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeImportKey=messages.StringField(1),
+)
+
 SESS_TYPEQUERY_REQUEST = endpoints.ResourceContainer(
     SessionTypeQueryForm,
     websafeConferenceKey=messages.StringField(1),
@@ -114,6 +203,26 @@ SESS_WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1)
 )
 
+CONF_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+SESS_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    websafeConferenceKey=messages.StringField(4),
+)
+
+TICKET_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeTicketKey=messages.StringField(1),
+)
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -123,32 +232,43 @@ SESS_WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    def initialize_request_state(self, request_state):
+        """Start every request with a fresh RequestContext."""
+        super(ConferenceApi, self).initialize_request_state(request_state)
+        self._context = RequestContext()
+
+    @property
+    def context(self):
+        """This request's RequestContext."""
+        if getattr(self, '_context', None) is None:
+            self._context = RequestContext()
+        return self._context
+
+    def _notModified(self, request, etag):
+        """True if the request's ifNoneMatch (or If-None-Match header)
+        names etag."""
+        ifNoneMatch = request.ifNoneMatch
+        if not ifNoneMatch:
+            headers = getattr(getattr(self, 'request_state', None),
+                              'headers', None)
+            ifNoneMatch = headers and headers.get('If-None-Match')
+        return etags.matches(etag, ifNoneMatch)
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return serializers.CONFERENCE.toForm(conf)
+
+    def _copyConferencesToForms(self, confs):
+        """Copy a list of Conferences to a list of ConferenceForms."""
+        return serializers.CONFERENCE.toForms(confs)
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm."""
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self.context.requireUser()
+        user_id = self.context.userId
 
         if not request.name:
             raise endpoints.BadRequestException(
@@ -157,8 +277,8 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name)
                 for field in request.all_fields()}
-        del data['websafeKey']
-        del data['organizerDisplayName']
+        for name in ('websafeKey',) + RESPONSE_ONLY_FIELDS:
+            del data[name]
 
         # add default values for those missing (both data model & outbound msg)
         for df in DEFAULTS:
@@ -188,9 +308,18 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # keep a copy of the organizer's name on the conference so reads
+        # don't need a second round trip for it
+        prof = self._getProfileFromUser()
+        data['organizerDisplayName'] = request.organizerDisplayName = (
+            prof.displayName)
+
+        # create Conference along with its seat shards, send email to
+        # organizer confirming creation & return (modified) ConferenceForm
+        conf = Conference(**data)
+        ndb.put_multi([conf] + seats.createShards(
+            conf, data.get('seatsAvailable') or 0))
+        fulltext.indexConferences([conf])
         taskqueue.add(params={'email': user.email(),
                       'conferenceInfo': repr(request)},
                       url='/tasks/send_confirmation_email'
@@ -199,10 +328,8 @@ class ConferenceApi(remote.Service):
 
     @ndb.transactional()
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        """Update Conference object, returning the updated Conference."""
+        user_id = self.context.userId
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name)
@@ -223,6 +350,7 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        oldMaxAttendees = conf.maxAttendees or 0
         for field in request.all_fields():
             data = getattr(request, field.name)
             # only copy fields where we get data
@@ -232,11 +360,29 @@ class ConferenceApi(remote.Service):
                     data = datetime.strptime(data, "%Y-%m-%d").date()
                     if field.name == 'startDate':
                         conf.month = data.month
+                # organizer name is maintained from the Profile, not here
+                if field.name == 'organizerDisplayName':
+                    continue
+                # conditional read fields the client may have echoed back
+                if field.name in RESPONSE_ONLY_FIELDS:
+                    continue
+                # seats of a sharded conference live on its SeatShards
+                if field.name == 'seatsAvailable' and conf.seatShards:
+                    continue
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # hand a change of capacity on to the seat shards once committed
+        seatDelta = (conf.maxAttendees or 0) - oldMaxAttendees
+        if seatDelta and conf.seatShards:
+            taskqueue.add(params={'websafeConferenceKey':
+                                  request.websafeConferenceKey,
+                                  'delta': seatDelta},
+                          url='/tasks/adjust_seats',
+                          transactional=True
+                          )
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return conf
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
@@ -249,22 +395,44 @@ class ConferenceApi(remote.Service):
                       http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
-
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+        # seats already taken can't be removed from a sharded conference
+        if request.maxAttendees is not None:
+            conf = cache.getConference(
+                ndb.Key(urlsafe=request.websafeConferenceKey))
+            if conf and conf.seatShards:
+                seats.refreshSeatsAvailable([conf])
+                taken = (conf.maxAttendees or 0) - conf.seatsAvailable
+                if request.maxAttendees < taken:
+                    raise endpoints.BadRequestException(
+                        "maxAttendees can't be below the %d seats already "
+                        "taken." % taken)
+        conf = self._updateConferenceObject(request)
+        cache.invalidate(conf.key)
+        fulltext.indexConferences([conf])
+        seats.refreshSeatsAvailable([conf])
+        return self._copyConferenceToForm(conf)
+
+    @endpoints.method(CONF_CONDITIONAL_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey), or just
+        notModified if it still matches ifNoneMatch."""
         # get Conference object from request; fail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = cache.getConference(
+            ndb.Key(urlsafe=request.websafeConferenceKey))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' %
                 request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        seats.refreshSeatsAvailable([conf])
+        etag = etags.conference(conf)
+        if self._notModified(request, etag):
+            return ConferenceForm(etag=etag, notModified=True)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        form = self._copyConferenceToForm(conf)
+        form.etag = etag
+        return form
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='getConferencesCreated',
@@ -272,128 +440,95 @@ class ConferenceApi(remote.Service):
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self.context.userId
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = seats.refreshSeatsAvailable(
+            Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch())
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm
-                   (conf, getattr(prof, 'displayName')) for conf in confs]
+            items=self._copyConferencesToForms(confs)
         )
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(
-                                  filtr["field"],
-                                  filtr["operator"],
-                                  filtr["value"])
-            q = q.filter(formatted_query)
-        return q
-
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
-        formatted_filters = []
-        inequality_field = None
-
-        for f in filters:
-            filtr = {field.name: getattr(f, field.name)
-                     for field in f.all_fields()}
-
-            try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
-            except KeyError:
-                raise endpoints.BadRequestException(
-                    "Filter contains invalid field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previously
-                # disallow the filter if inequality was performed before
-                # track field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
-
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+    def _getPageSize(self, request):
+        """Return the checked page size of a paginated request."""
+        pageSize = request.pageSize or DEFAULT_PAGE_SIZE
+        if pageSize < 1 or pageSize > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        return pageSize
+
+    def _getPageArgs(self, request):
+        """Return (page size, start cursor) from a paginated request."""
+        pageSize = self._getPageSize(request)
+        try:
+            cursor = Cursor(urlsafe=request.pageToken)
+        except Exception:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        return pageSize, cursor
+
+    @endpoints.method(CONF_SEARCH_REQUEST, ConferenceForms,
+                      path='searchConferences',
+                      http_method='GET', name='searchConferences')
+    def searchConferences(self, request):
+        """Full-text search of conference names, descriptions and topics,
+        best matches first, one page at a time."""
+        pageSize = self._getPageSize(request)
+        try:
+            c_keys, nextPageToken = fulltext.searchConferences(
+                request.query, pageSize, request.pageToken)
+        except (ValueError, search.QueryError):
+            raise endpoints.BadRequestException("Invalid query or pageToken.")
+        conferences = seats.refreshSeatsAvailable(
+            [conf for conf in cache.getConferences(c_keys) if conf])
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences),
+            nextPageToken=nextPageToken
+        )
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        """Query for conferences, one page at a time."""
+        pageSize, cursor = self._getPageArgs(request)
+        # stream the planned query once; everything below works off it
+        plan = planner.plan(request.filters)
+        conferences, next_cursor = plan.run(pageSize, cursor,
+                                            MAX_QUERY_SCAN)
+        seats.refreshSeatsAvailable(conferences)
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm
-                                      (conf, names[conf.organizerUserId])
-                                      for conf in conferences]
-                               )
-
+        return ConferenceForms(
+            items=self._copyConferencesToForms(conferences),
+            nextPageToken=next_cursor.urlsafe() if next_cursor else None,
+            queryPlan=(plan.explain()
+                       if request.explain and QUERY_EXPLAIN else None)
+        )
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf,
-                            field.name,
-                            getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return serializers.PROFILE.toForm(prof)
 
     def _getProfileFromUser(self):
         """
            Return user Profile from datastore, creating new one if non-existent
         """
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        ctx = self.context
+        user = ctx.requireUser()
+
+        # reuse this request's Profile, except in a transaction, which
+        # has to read it for itself
+        profile = ctx.profile
+        if profile is not None and not ndb.in_transaction():
+            return profile
 
         # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
+        p_key = ctx.profileKey
         profile = p_key.get()
 
         # create new Profile if not there
@@ -406,6 +541,7 @@ class ConferenceApi(remote.Service):
                              )
             profile.put()
 
+        ctx.profile = profile
         return profile      # return Profile
 
     def _doProfile(self, save_request=None):
@@ -415,6 +551,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            oldName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -424,15 +561,29 @@ class ConferenceApi(remote.Service):
                         #     setattr(prof, field, str(val).upper())
                         # else:
                         #     setattr(prof, field, val)
-                        prof.put()
+                        self.context.markDirty(prof)
+            self.context.flush()
+
+            # conferences carry a copy of the organizer's name; rewrite
+            # them in the background when it changes
+            if prof.displayName != oldName:
+                taskqueue.add(params={'userId': prof.key.id()},
+                              url='/tasks/update_organizer_name'
+                              )
 
         # return ProfileForm
-        return self._copyProfileToForm(prof)
+        form = self._copyProfileToForm(prof)
+        form.etag = etags.profile(prof)
+        return form
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @endpoints.method(PROFILE_GET_REQUEST, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
-        """Return user profile."""
+        """Return user profile, or just notModified if it still matches
+        ifNoneMatch."""
+        etag = etags.profile(self._getProfileFromUser())
+        if self._notModified(request, etag):
+            return ProfileForm(etag=etag, notModified=True)
         return self._doProfile()
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
@@ -441,46 +592,181 @@ class ConferenceApi(remote.Service):
         """Update & return user profile."""
         return self._doProfile(request)
 
+    @staticmethod
+    def _updateOrganizerDisplayName(userId, websafeCursor=None):
+        """Copy the organizer's current displayName onto a batch of their
+        conferences; used by the update_organizer_name task, which
+        re-enqueues itself until every conference has been rewritten.
+        """
+        p_key = ndb.Key(Profile, userId)
+        c_keys, next_cursor, more = Conference.query(
+            ancestor=p_key).fetch_page(
+                ORGANIZER_UPDATE_BATCH_SIZE,
+                start_cursor=Cursor(urlsafe=websafeCursor), keys_only=True)
+
+        # the conferences are children of the profile: re-read them all
+        # in one transaction so concurrent writes to them aren't reverted
+        @ndb.transactional()
+        def rename():
+            got = ndb.get_multi([p_key] + c_keys)
+            prof, confs = got[0], got[1:]
+            if not prof:
+                return []
+            stale = [conf for conf in confs if conf and
+                     conf.organizerDisplayName != prof.displayName]
+            for conf in stale:
+                conf.organizerDisplayName = prof.displayName
+            ndb.put_multi(stale)
+            return stale
+
+        for conf in rename() if c_keys else []:
+            cache.invalidate(conf.key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'userId': userId,
+                                  'cursor': next_cursor.urlsafe()},
+                          url='/tasks/update_organizer_name'
+                          )
+
+    @staticmethod
+    @ndb.transactional()
+    def _fillOrganizerDisplayName(c_key):
+        """Copy the organizer's displayName onto a conference that has
+        none; returns the conference if it was written. A Conference is
+        a child of its organizer's Profile, so both are read together.
+        """
+        conf, prof = ndb.get_multi([c_key, c_key.parent()])
+        if not conf or conf.organizerDisplayName or not prof:
+            return None
+        conf.organizerDisplayName = prof.displayName
+        conf.put()
+        return conf
+
+    @staticmethod
+    def _migrateOrganizerNames(websafeCursor=None):
+        """Fill organizerDisplayName on a batch of conferences created
+        before it was stored; used by the migrate_organizer_names task,
+        which re-enqueues itself until every conference has been visited.
+        Safe to re-run: conferences that have a name are left alone.
+        """
+        confs, next_cursor, more = Conference.query().fetch_page(
+            ORGANIZER_UPDATE_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor))
+
+        for conf in confs:
+            if conf.organizerDisplayName is not None:
+                continue
+            if ConferenceApi._fillOrganizerDisplayName(conf.key):
+                cache.invalidate(conf.key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/migrate_organizer_names'
+                          )
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _isNearlySoldOut(seatsAvailable):
+        """True if a conference with this many free seats is announced."""
+        return 0 < (seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS
+
+    @staticmethod
+    def _setAnnouncement(announcement):
+        """Render the NearlySoldOut set & mirror it into memcache."""
+        text = ""
+        if announcement and announcement.names:
+            text = ANNOUNCEMENT_TPL % ', '.join(announcement.names)
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, text)
+        return text
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateNearlySoldOut(add=(), remove=()):
+        """Add conferences to / remove conference keys from the
+        NearlySoldOut set; returns the set, or None if nothing changed.
+        """
+        key = ndb.Key(NearlySoldOut, NEARLY_SOLD_OUT_ID)
+        announcement = key.get() or NearlySoldOut(key=key)
+        entries = OrderedDict(zip(announcement.conferences,
+                                  announcement.names))
+        before = entries.copy()
+        for key in remove:
+            entries.pop(key, None)
+        for conf in add:
+            entries[conf.key] = conf.name
+        if entries == before:
+            return None
+        announcement.conferences = entries.keys()
+        announcement.names = entries.values()
+        announcement.put()
+        return announcement
+
+    @staticmethod
+    def _seatsMoved(conf, delta):
+        """Update the announcement if a registration (delta -1) or an
+        unregistration (+1) moved conf across the nearly sold out line.
+        """
+        after = seats.refreshSeatsAvailable([conf])[0].seatsAvailable
+        nearly = ConferenceApi._isNearlySoldOut(after)
+        if nearly == ConferenceApi._isNearlySoldOut(after - delta):
+            return
+        announcement = ConferenceApi._updateNearlySoldOut(
+            add=[conf] if nearly else [],
+            remove=[] if nearly else [conf.key])
+        if announcement:
+            ConferenceApi._setAnnouncement(announcement)
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the NearlySoldOut set with the live seat counts &
+        refresh the memcache copy; used by memcache cron job to repair
+        drift, registrations keep it current in between.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        announcement = ndb.Key(NearlySoldOut, NEARLY_SOLD_OUT_ID).get()
+        listed = announcement.conferences if announcement else []
 
-        return announcement
+        # seatsAvailable is a snapshot of the seat shards; confirm the
+        # candidates (and everything already listed) against live totals
+        candidates = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch()
+        known = set(conf.key for conf in candidates)
+        candidates.extend(conf for conf in ndb.get_multi(
+            [key for key in listed if key not in known]) if conf)
+        seats.refreshSeatsAvailable(candidates)
+
+        nearly = [conf for conf in candidates
+                  if ConferenceApi._isNearlySoldOut(conf.seatsAvailable)]
+        nearlyKeys = set(conf.key for conf in nearly)
+        # listed conferences that were deleted drop out too
+        gone = [key for key in listed if key not in nearlyKeys]
+        updated = ConferenceApi._updateNearlySoldOut(add=nearly,
+                                                     remove=gone)
+        return ConferenceApi._setAnnouncement(updated or announcement)
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(
-               data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if announcement is None:
+            announcement = self._setAnnouncement(
+                ndb.Key(NearlySoldOut, NEARLY_SOLD_OUT_ID).get())
+        return StringMessage(data=announcement)
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
+    @staticmethod
+    def _isRegistered(prof, registration, wsck):
+        """True if registration exists or wsck is on prof's legacy list."""
+        return bool(registration or
+                    (prof and wsck in prof.conferenceKeysToAttend))
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         prof = self._getProfileFromUser()  # get user Profile
 
         # check if conf exists given websafeConfKey
@@ -490,67 +776,303 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        if reg and conf.queuedRegistration:
+            raise endpoints.BadRequestException(
+                "Registration for this conference is queued; "
+                "use requestRegistration.")
+        conf = seats.ensureShards(conf)
+        r_key = ndb.Key(Registration, wsck, parent=prof.key)
+
+        # these run in the same (XG) transaction as the seat shard, so a
+        # retry sees the committed state; profiles not yet migrated off
+        # conferenceKeysToAttend are honoured too
+        def register():
+            r, p = ndb.get_multi([r_key, prof.key])
+            # check if user already registered otherwise add
+            if self._isRegistered(p, r, wsck):
+                raise ConflictException(
+                    "You have already registered for this conference")
+            Registration(key=r_key, conference=conf.key).put()
+            return True
+
+        def unregister():
+            r, p = ndb.get_multi([r_key, prof.key])
+            if r:
+                r_key.delete()
+            elif p and wsck in p.conferenceKeysToAttend:
+                p.conferenceKeysToAttend.remove(wsck)
+                p.put()
+            else:
+                return False
+            return True
+
+        registered = self._isRegistered(prof, r_key.get(), wsck)
 
         # register
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            # cheap check before touching any shard
+            if registered:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # register user, take away one seat
+            if not seats.takeSeat(conf, register):
                 raise ConflictException(
                     "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            self._seatsMoved(conf, -1)
             retval = True
 
-        # unregister
+        # unregister user, add back one seat
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            retval = registered and seats.releaseSeat(conf, unregister)
+            if retval:
+                self._seatsMoved(conf, 1)
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @staticmethod
+    def _copyTicketToForm(ticket):
+        """Copy RegistrationTicket to RegistrationTicketForm."""
+        return RegistrationTicketForm(
+            websafeTicketKey=ticket.key.urlsafe(),
+            websafeConferenceKey=ticket.conference.urlsafe(),
+            status=getattr(RegistrationStatus, ticket.status))
+
+    @staticmethod
+    def _scheduleDrain(wsck):
+        """Make sure a drain_registrations task runs for the conference
+        shortly; requests within one REGISTRATION_DRAIN_DELAY share it.
+        """
+        try:
+            taskqueue.add(name='drain-%s-%d' % (
+                              wsck, time.time() // REGISTRATION_DRAIN_DELAY),
+                          params={'websafeConferenceKey': wsck},
+                          url='/tasks/drain_registrations',
+                          countdown=REGISTRATION_DRAIN_DELAY
+                          )
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    def _queueRegistration(self, conf):
+        """Queue the user for a seat at conf; returns their ticket. Only
+        the user's own ticket is written, so there's no contention."""
+        prof = self._getProfileFromUser()
+        wsck = conf.key.urlsafe()
+        r_key = ndb.Key(Registration, wsck, parent=prof.key)
+        if self._isRegistered(prof, r_key.get(), wsck):
+            raise ConflictException(
+                "You have already registered for this conference")
+        t_key = ndb.Key(RegistrationTicket, '%s:%s' % (wsck, prof.key.id()))
+
+        @ndb.transactional()
+        def queue():
+            ticket = t_key.get()
+            if ticket and ticket.status in PENDING_TICKET_STATUSES:
+                return ticket
+            ticket = RegistrationTicket(key=t_key, conference=conf.key,
+                                        profile=prof.key, status='QUEUED')
+            ticket.put()
+            taskqueue.Queue(REGISTRATION_QUEUE).add(
+                taskqueue.Task(payload=t_key.urlsafe(), method='PULL',
+                               tag=wsck),
+                transactional=True)
+            return ticket
+
+        ticket = queue()
+        self._scheduleDrain(wsck)
+        return ticket
+
+    @staticmethod
+    def _drainRegistrations(wsck):
+        """Lease a batch of queued registrations for a conference and
+        allocate their seats; used by the drain_registrations task,
+        which re-enqueues itself while full batches keep coming.
+        """
+        queue = taskqueue.Queue(REGISTRATION_QUEUE)
+        tasks = queue.lease_tasks_by_tag(REGISTRATION_LEASE_SECONDS,
+                                         REGISTRATION_BATCH_SIZE, tag=wsck)
+        if not tasks:
+            return
+        t_keys = list(OrderedDict.fromkeys(
+            ndb.Key(urlsafe=task.payload) for task in tasks))
+        try:
+            ConferenceApi._allocateTickets(ndb.Key(urlsafe=wsck), t_keys)
+        except Exception:
+            # hand the tickets back at once for this task's retry
+            for task in tasks:
+                queue.modify_task_lease(task, 0)
+            raise
+        queue.delete_tasks(tasks)
+
+        if len(tasks) == REGISTRATION_BATCH_SIZE:
+            taskqueue.add(params={'websafeConferenceKey': wsck},
+                          url='/tasks/drain_registrations'
+                          )
+
+    @staticmethod
+    def _allocateTickets(c_key, t_keys):
+        """Give seats to a batch of queued tickets, in order, and write
+        their Registrations. Safe to re-run on the same tickets: a seat
+        is taken in the transaction that moves a ticket off QUEUED.
+        """
+        wsck = c_key.urlsafe()
+        conf = c_key.get()
+        tickets = [t for t in ndb.get_multi(t_keys) if t]
+        if not conf:
+            for ticket in tickets:
+                if ticket.status in PENDING_TICKET_STATUSES:
+                    ticket.status = 'CANCELLED'
+            ndb.put_multi(tickets)
+            return
+        conf = seats.ensureShards(conf)
+
+        # users who hold a seat already don't get another
+        queued = [t for t in tickets if t.status == 'QUEUED']
+        registered = ndb.get_multi(
+            [ndb.Key(Registration, wsck, parent=t.profile) for t in queued] +
+            [t.profile for t in queued])
+        fresh = []
+        for ticket, r, prof in zip(queued, registered[:len(queued)],
+                                   registered[len(queued):]):
+            if ConferenceApi._isRegistered(prof, r, wsck):
+                ticket.status = 'ALREADY_REGISTERED'
+            else:
+                fresh.append(ticket)
+
+        def claim(candidates, available):
+            claimed = [t for t in candidates
+                       if t and t.status == 'QUEUED'][:available]
+            for ticket in claimed:
+                ticket.status = 'ALLOCATED'
+            return claimed
+
+        claimed = dict((t.key, t) for t in
+                       seats.takeSeatsFor(conf, [t.key for t in fresh], claim))
+        for ticket in fresh:
+            if ticket.key not in claimed:
+                ticket.status = 'SOLD_OUT'
+
+        # seats are held now; write the registrations in bulk, including
+        # any left over from an earlier run that stopped half way
+        allocated = [claimed.get(t.key, t) for t in tickets
+                     if claimed.get(t.key, t).status == 'ALLOCATED']
+        ndb.put_multi([Registration(
+            key=ndb.Key(Registration, wsck, parent=t.profile),
+            conference=c_key) for t in allocated])
+        for ticket in allocated:
+            ticket.status = 'REGISTERED'
+        ndb.put_multi([claimed.get(t.key, t) for t in tickets])
+        if claimed:
+            ConferenceApi._seatsMoved(conf, -len(claimed))
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+                      path='conference/{websafeConferenceKey}/ticket',
+                      http_method='POST', name='requestRegistration')
+    def requestRegistration(self, request):
+        """Queue user for a seat at a conference in queued registration
+        mode; returns a ticket to poll with getRegistrationTicket."""
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if not conf.queuedRegistration:
+            raise endpoints.BadRequestException(
+                "Registration for this conference isn't queued; "
+                "use registerForConference.")
+        return self._copyTicketToForm(self._queueRegistration(conf))
+
+    @endpoints.method(TICKET_GET_REQUEST, RegistrationTicketForm,
+                      path='ticket/{websafeTicketKey}',
+                      http_method='GET', name='getRegistrationTicket')
+    def getRegistrationTicket(self, request):
+        """Return the state of one of user's registration tickets."""
+        try:
+            ticket = ndb.Key(urlsafe=request.websafeTicketKey).get()
+        except Exception:
+            ticket = None
+        if (not isinstance(ticket, RegistrationTicket) or
+                ticket.profile != self.context.profileKey):
+            raise endpoints.NotFoundException(
+                'No ticket found with key: %s' % request.websafeTicketKey)
+        return self._copyTicketToForm(ticket)
+
+    @endpoints.method(PAGE_GET_REQUEST, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
+        pageSize, cursor = self._getPageArgs(request)
         prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck)
-                     for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # the listing only reads Registrations, so move a legacy
+        # conferenceKeysToAttend over first
+        if prof.conferenceKeysToAttend:
+            self.context.profile = self._migrateRegistration(prof.key)
+
+        # Registration ids are the conference keys, so keys are enough
+        reg_keys, next_cursor, more = Registration.query(
+            ancestor=prof.key).fetch_page(pageSize, start_cursor=cursor,
+                                          keys_only=True)
+        conf_keys = [ndb.Key(urlsafe=r_key.id()) for r_key in reg_keys]
+        conferences = seats.refreshSeatsAvailable(
+            [conf for conf in cache.getConferences(conf_keys) if conf])
 
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-                               items=[self._copyConferenceToForm(conf,
-                                      names[conf.organizerUserId])
-                                      for conf in conferences]
-                              )
+            items=self._copyConferencesToForms(conferences),
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
+        )
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+                      path='conference/{websafeConferenceKey}/registration',
+                      http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Return whether user is registered for selected conference."""
+        prof = self._getProfileFromUser()  # get user Profile
+        wsck = request.websafeConferenceKey
+        r_key = ndb.Key(Registration, wsck, parent=prof.key)
+        return BooleanMessage(
+            data=self._isRegistered(prof, r_key.get(), wsck))
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateRegistration(p_key):
+        """Move a profile's legacy conferenceKeysToAttend onto
+        Registrations; returns the profile."""
+        prof = p_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return prof
+        ndb.put_multi([Registration(
+            key=ndb.Key(Registration, wsck, parent=p_key),
+            conference=ndb.Key(urlsafe=wsck))
+            for wsck in prof.conferenceKeysToAttend])
+        prof.conferenceKeysToAttend = []
+        prof.put()
+        return prof
+
+    @staticmethod
+    def _migrateRegistrations(websafeCursor=None):
+        """Move a batch of Profile.conferenceKeysToAttend lists onto
+        Registration entities; used by the migrate_registrations task,
+        which re-enqueues itself until every profile has been visited.
+        Safe to re-run: registrations are keyed by user and conference.
+        """
+        profiles, next_cursor, more = Profile.query().fetch_page(
+            REGISTRATION_MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor))
+
+        # each profile moves in its own transaction, re-reading it, so
+        # concurrent profile saves and unregistrations aren't undone
+        for prof in profiles:
+            if prof.conferenceKeysToAttend:
+                ConferenceApi._migrateRegistration(prof.key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/migrate_registrations'
+                          )
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
@@ -580,9 +1102,10 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.city == "London")
         q = q.filter(Conference.topics == "Medical Innovations")
         q = q.filter(Conference.month == 6)
+        q = seats.refreshSeatsAvailable(q.fetch())
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=self._copyConferencesToForms(q)
         )
 
 # ---------------------- Sessions ---------------------------------
@@ -593,37 +1116,156 @@ class ConferenceApi(remote.Service):
         """Create a session for given conference"""
         return self._createSessionObject(request)
 
-    def _createSessionObject(self, request):
-        """Create or Update Session object."""
-        # get user and verify user authentication
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    @endpoints.method(SESS_BATCH_POST_REQUEST, SessionCreateReturnForms,
+                      path='{websafeConferenceKey}/createSessions',
+                      http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create several sessions for given conference in one call"""
+        return self._createSessionObjects(request)
 
-        if not request.websafeConferenceKey:
+    @staticmethod
+    def _copyImportToForm(imp):
+        """Copy AgendaImport to AgendaImportStatusForm."""
+        return AgendaImportStatusForm(
+            websafeImportKey=imp.key.urlsafe(),
+            status=imp.status,
+            totalRows=imp.totalRows,
+            importedRows=imp.importedRows)
+
+    @endpoints.method(AGENDA_IMPORT_POST_REQUEST, AgendaImportStatusForm,
+                      path='{websafeConferenceKey}/importAgenda',
+                      http_method='POST', name='importAgenda')
+    def importAgenda(self, request):
+        """Import a CSV or JSON agenda of sessions into given conference.
+        Every row is checked first; the sessions are then written in the
+        background, see getAgendaImport for progress."""
+        c_key = self._getOwnedConferenceKey(request.websafeConferenceKey)
+        forms, errors = agenda.parse(request.data or '',
+                                     request.format or 'csv',
+                                     self._sessionDataFromForm,
+                                     MAX_IMPORT_ROWS)
+        if errors:
             raise endpoints.BadRequestException(
-                "Session 'conference key' field reqruied")
+                '; '.join(errors[:MAX_IMPORT_ERRORS]))
+        if not forms:
+            raise endpoints.BadRequestException("No sessions given")
+
+        # ids are reserved up front, so a retried chunk rewrites the
+        # same sessions instead of adding new ones
+        first, _ = Session.allocate_ids(size=len(forms), parent=c_key)
+        imp_key = ndb.Key(AgendaImport, AgendaImport.allocate_ids(
+            size=1, parent=c_key)[0], parent=c_key)
+        chunks = [AgendaImportChunk(
+            key=ndb.Key(AgendaImportChunk, seq + 1, parent=imp_key),
+            rows=agenda.dumps(forms[start:start + IMPORT_CHUNK_SIZE]))
+            for seq, start in enumerate(
+                range(0, len(forms), IMPORT_CHUNK_SIZE))]
+        imp = AgendaImport(key=imp_key, status='RUNNING',
+                           totalRows=len(forms), importedRows=0,
+                           chunks=len(chunks), doneChunks=0,
+                           firstSessionId=first)
+
+        @ndb.transactional()
+        def create():
+            ndb.put_multi([imp] + chunks)
+            self._enqueueImportChunk(imp_key, 0)
+        create()
+        return self._copyImportToForm(imp)
+
+    @endpoints.method(AGENDA_IMPORT_GET_REQUEST, AgendaImportStatusForm,
+                      path='agendaImport/{websafeImportKey}',
+                      http_method='GET', name='getAgendaImport')
+    def getAgendaImport(self, request):
+        """Return the progress of an agenda import."""
+        try:
+            imp_key = ndb.Key(urlsafe=request.websafeImportKey)
+        except Exception:
+            imp_key = None
+        if not imp_key or imp_key.kind() != 'AgendaImport':
+            raise endpoints.NotFoundException(
+                'No import found with key: %s' % request.websafeImportKey)
+        self._getOwnedConferenceKey(imp_key.parent().urlsafe())
+        imp = imp_key.get()
+        if not imp:
+            raise endpoints.NotFoundException(
+                'No import found with key: %s' % request.websafeImportKey)
+        return self._copyImportToForm(imp)
 
-        if not request.name:
-            raise endpoints.BadRequestException(
-                "Session 'name' field required")
+    @staticmethod
+    def _enqueueImportChunk(imp_key, seq):
+        taskqueue.add(params={'websafeImportKey': imp_key.urlsafe(),
+                              'seq': seq},
+                      url='/tasks/import_agenda',
+                      transactional=True
+                      )
 
-        # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name)
-                for field in request.all_fields()}
-        del data['websafeKey']
-        del data['websafeConferenceKey']
+    @staticmethod
+    def _importAgendaChunk(websafeImportKey, seq):
+        """Write one chunk of an agenda import; used by the import_agenda
+        task, which enqueues the next chunk in the same transaction.
+        Re-running a written chunk does nothing.
+        """
+        imp_key = ndb.Key(urlsafe=websafeImportKey)
+        chunk_key = ndb.Key(AgendaImportChunk, seq + 1, parent=imp_key)
+        imp, chunk = ndb.get_multi([imp_key, chunk_key])
+        if not imp or not chunk or chunk.done:
+            return
+        forms = agenda.loads(chunk.rows)
+
+        # runs in the session write transaction; the import, its chunks
+        # and the sessions all live in the conference's entity group
+        def claim():
+            imp, chunk = ndb.get_multi([imp_key, chunk_key])
+            if chunk.done:
+                return False
+            chunk.done = True
+            imp.importedRows += len(forms)
+            imp.doneChunks += 1
+            if imp.doneChunks == imp.chunks:
+                imp.status = 'DONE'
+            else:
+                ConferenceApi._enqueueImportChunk(imp_key, seq + 1)
+            ndb.put_multi([imp, chunk])
+            return True
+
+        ConferenceApi._putSessions(
+            imp_key.parent(), forms,
+            first=imp.firstSessionId + seq * IMPORT_CHUNK_SIZE, claim=claim)
+
+    def _getOwnedConferenceKey(self, websafeConferenceKey):
+        """Return key of given conference, checking user is its owner."""
+        # get user and verify user authentication
+        user_id = self.context.userId
+
+        if not websafeConferenceKey:
+            raise endpoints.BadRequestException(
+                "Session 'conference key' field reqruied")
 
         # get the conference object
-        websafeConferenceKey = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        conf = cache.getConference(c_key)
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafeConferenceKey)
 
         # check if the current user is the creator of the conference
         # if not raise exception
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 "You are not authorized to create session")
+        return c_key
+
+    @staticmethod
+    def _sessionDataFromForm(form):
+        """Validate a SessionForm and return it as Session field values."""
+        if not form.name:
+            raise endpoints.BadRequestException(
+                "Session 'name' field required")
+
+        # copy SessionForm/ProtoRPC Message into dict
+        data = {field.name: getattr(form, field.name)
+                for field in SessionForm.all_fields()}
+        del data['websafeKey']
 
         # convert dates from string to Date object;
         if data['date']:
@@ -632,7 +1274,6 @@ class ConferenceApi(remote.Service):
 
         # convert startTime from string to time object
         if data['startTime']:
-            print data['startTime']
             data['startTime'] = datetime.strptime(data['startTime'][:5],
                                                   "%H:%M").time()
 
@@ -641,58 +1282,94 @@ class ConferenceApi(remote.Service):
             data['typeOfSession'] = str(data['typeOfSession'])
         else:
             data['typeOfSession'] = 'Unknown'
+        return data
 
-        # generate session ID based on conference key
-        c_key = ndb.Key(urlsafe=websafeConferenceKey)
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        # generate session key based on session ID and conference key
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
-
-        # create Session, add session to memcache if the session speaker is
-        # featured speaker
-        Session(**data).put()
-        speaker = data['speaker']
-        sessionName = data['name']
-        if speaker:
-            taskqueue.add(params={'speaker': speaker,
-                                  'sessionName': sessionName,
-                                  'websafeConfKey': websafeConferenceKey},
-                          url='/tasks/add_featured_session'
-                          )
+    @staticmethod
+    def _putSessions(c_key, forms, first=None, claim=None):
+        """Create Sessions from SessionForms under the given conference,
+        with one id allocation and one transactional put_multi that also
+        updates the conference's speaker index; returns the new Sessions.
+
+        Callers that reserved ids beforehand pass the first one. claim()
+        runs in the write transaction; if it returns False nothing is
+        written and None is returned.
+        """
+        datas = [ConferenceApi._sessionDataFromForm(form) for form in forms]
 
-        return SessionCreateReturnForm(name=data['name'],
-                                       websafeSessionKey=s_key.urlsafe())
+        # reserve a range of session IDs based on conference key
+        if first is None:
+            first, last = Session.allocate_ids(size=len(datas),
+                                               parent=c_key)
+        else:
+            last = first + len(datas) - 1
+        sessions = [Session(key=ndb.Key(Session, s_id, parent=c_key), **data)
+                    for s_id, data in zip(range(first, last + 1), datas)]
+
+        # sessions and speaker index share the conference's entity group
+        @ndb.transactional()
+        def put():
+            if claim and not claim():
+                return None
+            updated = ConferenceApi._indexSpeakers(c_key, sessions)
+            ndb.put_multi(sessions + updated)
+            speakers.enqueueIndex(c_key, first, last)
+            return [e for e in updated if isinstance(e, FeaturedSpeaker)]
+
+        featured = put()
+        if featured is None:
+            return None
+        cache.invalidate(c_key)
+        fulltext.indexSessions(sessions)
+        if featured:
+            # getFeaturedSpeaker refills it from the datastore
+            memcache.delete(MEMCACHE_FEATUREDSPEAKER_KEY % c_key.urlsafe())
+        return sessions
+
+    def _createSessionObject(self, request):
+        """Create Session object."""
+        c_key = self._getOwnedConferenceKey(request.websafeConferenceKey)
+        session = self._putSessions(c_key, [request])[0]
+        return SessionCreateReturnForm(name=session.name,
+                                       websafeSessionKey=session.key.urlsafe())
+
+    def _createSessionObjects(self, request):
+        """Create a batch of Session objects for one conference."""
+        if not request.items:
+            raise endpoints.BadRequestException("No sessions given")
+        if len(request.items) > MAX_SESSIONS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                "At most %d sessions per call" % MAX_SESSIONS_PER_BATCH)
+        c_key = self._getOwnedConferenceKey(request.websafeConferenceKey)
+        sessions = self._putSessions(c_key, request.items)
+        return SessionCreateReturnForms(
+            items=[SessionCreateReturnForm(name=session.name,
+                                           websafeSessionKey=session.key
+                                           .urlsafe())
+                   for session in sessions])
 
     @endpoints.method(SESS_GET_REQUEST, SessionForms,
                       path='{websafeConferenceKey}/getConferenceSessions',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
-        """Get all sessions for given conference"""
-        ancestor_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        sessions = Session.query(ancestor=ancestor_key).fetch()
+        """Get all sessions for given conference, or just notModified if
+        they still match ifNoneMatch"""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        sessions = cache.getConferenceSessions(c_key)
+        etag = etags.sessions(c_key, sessions)
+        if self._notModified(request, etag):
+            return SessionForms(etag=etag, notModified=True)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._copySessionsToForms(sessions),
+            etag=etag
             )
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                if field.name == 'typeOfSession':
-                    setattr(sf,
-                            field.name,
-                            getattr(TypeOfSession,
-                                    getattr(session, field.name)))
-                # convert Date to date string; just copy others
-                elif field.name == 'date' or field.name == 'startTime':
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, session.key.urlsafe())
-        return sf
+        return serializers.SESSION.toForm(session)
+
+    def _copySessionsToForms(self, sessions):
+        """Copy a list of Sessions to a list of SessionForms."""
+        return serializers.SESSION.toForms(sessions)
 
     @endpoints.method(SESS_TYPEQUERY_REQUEST, SessionForms,
                       path='{websafeConferenceKey}/sessionsByType',
@@ -705,191 +1382,569 @@ class ConferenceApi(remote.Service):
            Session.typeOfSession == request.sessionType).fetch()
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._copySessionsToForms(sessions)
             )
 
     @endpoints.method(SessionSpeakerQueryForm, SessionForms,
                       path='/sessionsBySpeaker',
                       http_method='POST', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
-        """Get all sessions for given speaker"""
-        sessions = Session.query(Session.speaker == request.speaker)
+        """Get sessions for given speaker across conferences, a page at
+        a time; the speaker is matched on normalized name, initials
+        matching either way ("J. Smith" and "John Smith")"""
+        pageSize = self._getPageSize(request)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+        # the speaker index holds the session keys, in order of creation
+        s_keys = speakers.sessionKeys(request.speaker or '')
+        page = s_keys[offset:offset + pageSize]
+        sessions = [s for s in ndb.get_multi(page) if s]
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._copySessionsToForms(sessions),
+            nextPageToken=(str(offset + pageSize)
+                           if offset + pageSize < len(s_keys) else None)
+            )
+
+    @endpoints.method(SESS_SEARCH_REQUEST, SessionForms,
+                      path='searchSessions',
+                      http_method='GET', name='searchSessions')
+    def searchSessions(self, request):
+        """Full-text search of session names, highlights and speakers,
+        optionally within one conference, best matches first"""
+        pageSize = self._getPageSize(request)
+        wsck = None
+        if request.websafeConferenceKey:
+            try:
+                wsck = ndb.Key(urlsafe=request.websafeConferenceKey).urlsafe()
+            except Exception:
+                raise endpoints.BadRequestException(
+                    "Invalid websafeConferenceKey")
+        try:
+            s_keys, nextPageToken = fulltext.searchSessions(
+                request.query, pageSize, request.pageToken, wsck)
+        except (ValueError, search.QueryError):
+            raise endpoints.BadRequestException("Invalid query or pageToken.")
+        sessions = [s for s in ndb.get_multi(s_keys) if s]
+        return SessionForms(
+            items=self._copySessionsToForms(sessions),
+            nextPageToken=nextPageToken
             )
 
 # ---------------------------Session Wishlist APIs-----------------------------
-    @endpoints.method(SESS_WISHLIST_POST_REQUEST, BooleanMessage,
+    @staticmethod
+    def _wishlistItemKey(p_key, websafeSessionKey):
+        """Key of the WishlistItem for a session in a user's wishlist."""
+        return ndb.Key(WishlistItem, websafeSessionKey, parent=p_key)
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateWishlist(p_key):
+        """Move a profile's legacy sessionsWishlist onto WishlistItems."""
+        prof = p_key.get()
+        if not prof or not prof.sessionsWishlist:
+            return
+        ndb.put_multi([WishlistItem(
+            key=ConferenceApi._wishlistItemKey(p_key, wssk),
+            session=ndb.Key(urlsafe=wssk)) for wssk in prof.sessionsWishlist])
+        prof.sessionsWishlist = []
+        prof.put()
+
+    @staticmethod
+    def _migrateWishlists(websafeCursor=None):
+        """Migrate a batch of profiles' legacy wishlists; used by the
+        migrate_wishlists task, which re-enqueues itself until every
+        profile has been visited.
+        """
+        profiles, next_cursor, more = Profile.query().fetch_page(
+            REGISTRATION_MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor))
+        for prof in profiles:
+            if prof.sessionsWishlist:
+                ConferenceApi._migrateWishlist(prof.key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/migrate_wishlists'
+                          )
+
+    @staticmethod
+    def _wishlistScheduleKey(p_key):
+        """Key of the WishlistSchedule of a user."""
+        return ndb.Key(WishlistSchedule, 1, parent=p_key)
+
+    @staticmethod
+    def _ensureWishlistSchedule(p_key):
+        """Build the user's WishlistSchedule from their wishlist if they
+        don't have one yet; returns it."""
+        sched_key = ConferenceApi._wishlistScheduleKey(p_key)
+        sched = sched_key.get()
+        if sched:
+            return sched
+
+        # sessions live in other entity groups, so read them up front for
+        # the items that don't carry their interval
+        items = WishlistItem.query(ancestor=p_key).fetch()
+        intervals = dict(
+            (session.key, schedule.interval(session))
+            for session in ndb.get_multi(
+                [item.session for item in items if not item.start])
+            if session)
+
+        @ndb.transactional()
+        def build():
+            sched = sched_key.get()
+            if sched:
+                return sched
+            sched = WishlistSchedule(key=sched_key)
+            for item in WishlistItem.query(ancestor=p_key):
+                span = ((item.start, item.end) if item.start else
+                        intervals.get(item.session))
+                if span:
+                    schedule.insert(sched, item.session, *span)
+            sched.put()
+            return sched
+        return build()
+
+    def _updateWishlist(self, add=(), remove=()):
+        """Add and remove sessions (websafe keys) to/from the user's
+        wishlist in one transaction; returns (added, removed, conflicts),
+        conflicts mapping each added session to the wishlisted sessions
+        it overlaps. Raises if an added session doesn't exist.
+        """
+        if len(add) + len(remove) > MAX_WISHLIST_UPDATE:
+            raise endpoints.BadRequestException(
+                "At most %d wishlist changes per call" % MAX_WISHLIST_UPDATE)
+        # repeated keys count once; a key can't be both added and removed
+        add = list(OrderedDict.fromkeys(add))
+        remove = list(OrderedDict.fromkeys(remove))
+        both = set(add) & set(remove)
+        if both:
+            raise endpoints.BadRequestException(
+                "Sessions both added and removed: %s" %
+                ', '.join(sorted(both)))
+        prof = self._getProfileFromUser()
+        if prof.sessionsWishlist:
+            self._migrateWishlist(prof.key)
+        self._ensureWishlistSchedule(prof.key)
+
+        # sessions live in other entity groups, so check them up front
+        try:
+            s_keys = [ndb.Key(urlsafe=wssk) for wssk in add]
+        except Exception:
+            raise endpoints.BadRequestException("Invalid session key")
+        sessions = ndb.get_multi(s_keys)
+        for wssk, session in zip(add, sessions):
+            if not session or session.key.kind() != 'Session':
+                raise endpoints.NotFoundException(
+                    'No session found with key: %s' % wssk)
+
+        # wishlist items and schedule are all children of the profile
+        @ndb.transactional()
+        def update():
+            addKeys = [self._wishlistItemKey(prof.key, wssk) for wssk in add]
+            removeKeys = [self._wishlistItemKey(prof.key, wssk)
+                          for wssk in remove]
+            found = ndb.get_multi(addKeys + removeKeys +
+                                  [self._wishlistScheduleKey(prof.key)])
+            items, sched = found[:-1], found[-1]
+
+            new, conflicts = [], {}
+            for key, session, item in zip(addKeys, sessions, items):
+                if item:
+                    continue
+                span = schedule.interval(session)
+                new.append(WishlistItem(key=key, session=session.key,
+                                        start=span and span[0],
+                                        end=span and span[1]))
+                if span:
+                    conflicts[key.id()] = [
+                        s_key.urlsafe()
+                        for s_key in schedule.overlapping(sched, *span)]
+                    schedule.insert(sched, session.key, *span)
+            gone = [item for item in items[len(addKeys):] if item]
+            for item in gone:
+                schedule.remove(sched, item.session)
+
+            ndb.put_multi(new + [sched])
+            ndb.delete_multi([item.key for item in gone])
+            return ([item.key.id() for item in new],
+                    [item.key.id() for item in gone],
+                    conflicts)
+        return update()
+
+    @endpoints.method(SESS_WISHLIST_POST_REQUEST, WishlistAddForm,
                       path='{websafeSessionKey}/addSessionToWishlist',
                       http_method='POST', name='addSessionToWishlist')
-    @ndb.transactional()
     def addSessionToWishlist(self, request):
-        """ Add a session to current user's wishlist """
-        # get user Profile
-        prof = self._getProfileFromUser()
-        # get session; check that it exists
-        # check if session exists given websafeSessionKey
-        websafeSessionKey = request.websafeSessionKey
-        session = ndb.Key(urlsafe=websafeSessionKey).get()
-
-        if not session:
-            raise endpoints.NotFoundException('No such session found!')
-        elif session.key.urlsafe() in prof.sessionsWishlist:
-            raise endpoints.ConflictException(
+        """ Add a session to current user's wishlist; also returns the
+        wishlisted sessions it overlaps """
+        added, _, conflicts = self._updateWishlist(
+            add=[request.websafeSessionKey])
+        if not added:
+            raise ConflictException(
                 'This session is already on you wish list')
-        else:
-            prof.sessionsWishlist.append(websafeSessionKey)
-
-        prof.put()
-        return BooleanMessage(data=True)
-
-    @endpoints.method(message_types.VoidMessage, SessionWishlistForm,
+        return WishlistAddForm(data=True,
+                               conflicts=conflicts.get(added[0], []))
+
+    @endpoints.method(message_types.VoidMessage, WishlistConflictForms,
+                      path='/getWishlistConflicts',
+                      http_method='GET', name='getWishlistConflicts')
+    def getWishlistConflicts(self, request):
+        """ Get every pair of overlapping sessions in current user's
+        wishlist """
+        prof = self._getProfileFromUser()
+        if prof.sessionsWishlist:
+            self._migrateWishlist(prof.key)
+        pairs = schedule.conflicts(self._ensureWishlistSchedule(prof.key))
+
+        s_keys = list(OrderedDict.fromkeys(
+            s_key for pair in pairs for s_key in pair))
+        sessions = dict(zip(s_keys, ndb.get_multi(s_keys)))
+        # sessions deleted since they were wishlisted are left out
+        return WishlistConflictForms(items=[
+            WishlistConflictForm(
+                first=self._copySessionToForm(sessions[first]),
+                second=self._copySessionToForm(sessions[second]))
+            for first, second in pairs
+            if sessions[first] and sessions[second]])
+
+    @endpoints.method(PAGE_GET_REQUEST, SessionWishlistForm,
                       path='/getSessionsInWishlist',
                       http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
-        """ Get sessions from current user's wishlist """
+        """ Get sessions from current user's wishlist, a page at a time """
+        pageSize, cursor = self._getPageArgs(request)
         # get user Profile
         prof = self._getProfileFromUser()
-        sessionsKeyList = [ndb.Key(urlsafe=sessionKey)
-                           for sessionKey in prof.sessionsWishlist]
-        sessions = ndb.get_multi(sessionsKeyList)
-        # return SessioinWishListForm
+        if prof.sessionsWishlist:
+            self._migrateWishlist(prof.key)
+
+        # WishlistItem ids are the session keys, so keys are enough
+        item_keys, next_cursor, more = WishlistItem.query(
+            ancestor=prof.key).fetch_page(pageSize, start_cursor=cursor,
+                                          keys_only=True)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=key.id())
+                                  for key in item_keys])
+        # return SessioinWishListForm, skipping sessions deleted since
         return SessionWishlistForm(
-            items=[self._copySessionToForm(session)
-                   for session in sessions]
+            items=self._copySessionsToForms(
+                [session for session in sessions if session]),
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
             )
 
     @endpoints.method(SESS_WISHLIST_POST_REQUEST, BooleanMessage,
                       path='{websafeSessionKey}/deleteSessionInWishlist',
                       http_method='POST', name='deleteSessionInWishlist')
-    @ndb.transactional()
     def deleteSessionInWishlist(self, request):
         """ Delete a session from current user's wishlist """
-        # get user Profile
-        prof = self._getProfileFromUser()
-        # get session; check that it exists
-        # check if session exists given websafeSessionKey
-        websafeSessionKey = request.websafeSessionKey
-        session = ndb.Key(urlsafe=websafeSessionKey).get()
-
-        if not session:
-            raise endpoints.NotFoundException('No such session found!')
-        elif session.key.urlsafe() in prof.sessionsWishlist:
-            prof.sessionsWishlist.remove(websafeSessionKey)
-        else:
+        _, removed, _ = self._updateWishlist(
+            remove=[request.websafeSessionKey])
+        if not removed:
             raise endpoints.NotFoundException(
                 'This session is not in your wish list')
-
-        prof.put()
         return BooleanMessage(data=True)
 
+    @endpoints.method(WishlistUpdateForm, WishlistUpdateForm,
+                      path='/updateWishlist',
+                      http_method='POST', name='updateWishlist')
+    def updateWishlist(self, request):
+        """ Add and remove many sessions to/from the wishlist at once;
+        returns the sessions that were actually added and removed """
+        added, removed, _ = self._updateWishlist(add=request.add,
+                                                 remove=request.remove)
+        return WishlistUpdateForm(add=added, remove=removed)
+
 # ------------------------------ Additional queries ---------------------------
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_ONGOING_GET_REQUEST, ConferenceForms,
                       path='/getOngoingConferences',
                       http_method='GET', name='getOngoingConferences')
     def getOngoingConferences(self, request):
-        """Get all conference that are ongoing"""
-        today = date.today()
-        conferences = Conference.query().filter(
-            Conference.startDate <= today).order(Conference.startDate).fetch()
-        if not conferences:
-            raise endpoints.NotFoundException('No conference is active now.')
+        """Get conferences that are ongoing on given date (default today)"""
+        pageSize, cursor = self._getPageArgs(request)
+        if request.date:
+            try:
+                day = datetime.strptime(request.date[:10], "%Y-%m-%d").date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "date must be formatted as YYYY-MM-DD")
+        else:
+            day = date.today()
+
+        # every conference is indexed under each day it runs
+        conferences, next_cursor, more = Conference.query(
+            Conference.activeDays == day).fetch_page(pageSize,
+                                                     start_cursor=cursor)
+        if not conferences and not request.pageToken:
+            raise endpoints.NotFoundException(
+                'No conference is active on %s.' % day)
+        seats.refreshSeatsAvailable(conferences)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(cf, cf.organizerUserId)
-                   for cf in conferences if
-                   (cf.endDate and cf.endDate >= today)])
+            items=self._copyConferencesToForms(conferences),
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
+        )
+
+    @staticmethod
+    def _reindexConferences(websafeCursor=None):
+        """Re-put a batch of conferences so derived index properties
+        (activeDays) are filled in; used by the reindex_conferences task,
+        which re-enqueues itself until every conference is written.
+        """
+        c_keys, next_cursor, more = Conference.query().fetch_page(
+            REINDEX_BATCH_SIZE, start_cursor=Cursor(urlsafe=websafeCursor),
+            keys_only=True)
+        byOrganizer = OrderedDict()
+        for c_key in c_keys:
+            byOrganizer.setdefault(c_key.parent(), []).append(c_key)
+
+        # re-read and re-put each organizer's conferences in one
+        # transaction, so an update committed meanwhile isn't undone
+        @ndb.transactional()
+        def reput(keys):
+            ndb.put_multi([conf for conf in ndb.get_multi(keys) if conf])
+
+        for keys in byOrganizer.values():
+            reput(keys)
+        for c_key in c_keys:
+            cache.invalidate(c_key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/reindex_conferences'
+                          )
+
+    @staticmethod
+    def _reindexSessions(websafeCursor=None):
+        """Re-put a batch of sessions so derived index properties
+        (preferred) are filled in; used by the reindex_sessions task,
+        which re-enqueues itself until every session is written.
+        """
+        sessions, next_cursor, more = Session.query().fetch_page(
+            REINDEX_BATCH_SIZE, start_cursor=Cursor(urlsafe=websafeCursor))
+        if sessions:
+            ndb.put_multi(sessions)
+            # the puts bump the sessions' versions; drop cached lists
+            for c_key in set(session.key.parent() for session in sessions):
+                cache.invalidate(c_key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/reindex_sessions'
+                          )
+
+    def _sessionQuery(self, websafeConferenceKey):
+        """Session query over one conference, or all of them."""
+        if not websafeConferenceKey:
+            return Session.query()
+        try:
+            c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException("Invalid websafeConferenceKey")
+        return Session.query(ancestor=c_key)
 
     @endpoints.method(SessionDateRangeQueryForm, SessionForms,
                       path='/getSessionsByDateRange',
                       http_method='POST', name='getSessionsByDateRange')
     def getSessionsByDateRange(self, request):
-        """Get all sessions for a given date range"""
-        startDate = datetime.strptime(request.startDate, "%Y-%m-%d").date()
-        endDate = datetime.strptime(request.endDate, "%Y-%m-%d").date()
-        if not startDate:
+        """Get sessions for a given date range, a page at a time,
+        optionally within one conference"""
+        if not request.startDate:
             raise endpoints.BadRequestException("startDate is required!")
-        if not endDate:
+        if not request.endDate:
             raise endpoints.BadRequestException("endDate is required!")
-        sessions = Session.query().filter(
-            Session.date >= startDate).filter(
-                Session.date <= endDate).order(Session.date).fetch()
+        try:
+            startDate = datetime.strptime(request.startDate[:10],
+                                          "%Y-%m-%d").date()
+            endDate = datetime.strptime(request.endDate[:10],
+                                        "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "dates must be formatted as YYYY-MM-DD")
+        pageSize, cursor = self._getPageArgs(request)
+
+        sessions, next_cursor, more = self._sessionQuery(
+            request.websafeConferenceKey).filter(
+                Session.date >= startDate).filter(
+                    Session.date <= endDate).order(Session.date).fetch_page(
+                        pageSize, start_cursor=cursor)
 
-        if not sessions:
+        if not sessions and not request.pageToken:
             raise endpoints.NotFoundException(
                 'No session is available in this date range.')
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._copySessionsToForms(sessions),
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
             )
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(SESS_PREFERRED_GET_REQUEST, SessionForms,
                       path='/getPreferredSessions',
                       http_method='GET', name='getPreferredSessions')
     def getPreferredSessions(self, request):
-        """Get all sessions that are not workshops and before 7 pm"""
-        allowedSesstionType = ['Unknown', 'Lecture', 'Keynote']
-        timethres = datetime.strptime("19:00", "%H:%M").time()
-        sessions = Session.query(
-            Session.typeOfSession.IN(allowedSesstionType)).filter(
-                Session.startTime <= timethres).order(
-                    Session.startTime).fetch()
-
-        if not sessions:
+        """Get sessions that are not workshops and start by 7 pm, a page
+        at a time, optionally within one conference"""
+        pageSize, cursor = self._getPageArgs(request)
+        # Session.preferred is set on put, see Session._pre_put_hook
+        sessions, next_cursor, more = self._sessionQuery(
+            request.websafeConferenceKey).filter(
+                Session.preferred == True).order(
+                    Session.startTime).fetch_page(pageSize,
+                                                  start_cursor=cursor)
+
+        if not sessions and not request.pageToken:
             raise endpoints.NotFoundException(
-                'No session is available in this date range.')
+                'No preferred session is available.')
 
         return SessionForms(
-                   items=[self._copySessionToForm(session)
-                          for session in sessions if session.startTime]
-               )
+            items=self._copySessionsToForms(sessions),
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
+            )
 
-    @endpoints.method(message_types.VoidMessage, FeaturedSpeakerQueryForm,
+    @endpoints.method(CONF_GET_REQUEST, FeaturedSpeakerQueryForm,
                       path='/getFeaturedSpeaker',
                       http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """
-        Try to get current feature speaker, if it exists.
-        Else return an empty form. The background task which set the
-        featuredSpeaker may be running shortly
+        Get the featured speaker of given conference, if there is one.
+        Else return an empty form.
         """
-        featuredSpeakerForm = memcache.get(MEMCACHE_FEATUREDSPEAKER_KEY)
-        if not featuredSpeakerForm:
-            featuredSpeakerForm = FeaturedSpeakerQueryForm()
+        wsck = request.websafeConferenceKey
+        if not wsck:
+            raise endpoints.BadRequestException(
+                "websafeConferenceKey is required!")
+        featuredSpeakerForm = memcache.get(MEMCACHE_FEATUREDSPEAKER_KEY % wsck)
+        if featuredSpeakerForm is None:
+            featured = ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                               parent=ndb.Key(urlsafe=wsck)).get()
+            featuredSpeakerForm = self._copyFeaturedSpeakerToForm(featured)
+            memcache.set(MEMCACHE_FEATUREDSPEAKER_KEY % wsck,
+                         featuredSpeakerForm)
         return featuredSpeakerForm
 
     @staticmethod
-    def addFeaturedSession(speaker, sessionName, confKey):
+    def _copyFeaturedSpeakerToForm(featured):
+        """Copy FeaturedSpeaker to FeaturedSpeakerQueryForm."""
+        if not featured:
+            return FeaturedSpeakerQueryForm()
+        return FeaturedSpeakerQueryForm(
+            featuredSpeaker=featured.speaker,
+            featuredSessions=featured.sessionNames)
+
+    @staticmethod
+    @ndb.transactional()
+    def _rebuildSpeakerIndex(c_key):
+        """Recount a conference's SpeakerSessionCounts and FeaturedSpeaker
+        from all its sessions; returns the FeaturedSpeaker, or None.
         """
-        This is an task that can add a session into the
-        FeaturedSpeakerQueryForm in memcache
+        featured_key = ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                               parent=c_key)
+        names = OrderedDict()
+        for session in Session.query(ancestor=c_key):
+            if session.speaker:
+                names.setdefault(session.speaker, []).append(session.name)
+        stale = [key for key in SpeakerSessionCount.query(
+            ancestor=c_key).fetch(keys_only=True) if key.id() not in names]
+        # the FeaturedSpeaker is either put or deleted
+        if len(names) + len(stale) + 1 > MAX_SPEAKER_INDEX_WRITES:
+            logging.warning('%s has too many speakers to index',
+                            c_key.urlsafe())
+            return featured_key.get()
+
+        counts = [SpeakerSessionCount(
+            key=ndb.Key(SpeakerSessionCount, speaker, parent=c_key),
+            speaker=speaker, sessionNames=sessionNames)
+            for speaker, sessionNames in names.items()]
+        top = ConferenceApi._featuredCount(counts)
+        featured = None
+        if top:
+            featured = FeaturedSpeaker(key=featured_key, speaker=top.speaker,
+                                       sessionNames=top.sessionNames)
+        else:
+            stale.append(featured_key)
+        ndb.put_multi(counts + ([featured] if featured else []))
+        ndb.delete_multi(stale)
+        return featured
+
+    @staticmethod
+    def _rebuildFeaturedSpeakers(websafeCursor=None):
+        """Rebuild the speaker index of a batch of conferences from their
+        existing sessions; used by the rebuild_featured_speakers task,
+        which re-enqueues itself until every conference has been visited.
+        Safe to re-run: each conference is recounted from scratch.
         """
-        if not speaker:
-            return
+        c_keys, next_cursor, more = Conference.query().fetch_page(
+            FEATURED_REBUILD_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor), keys_only=True)
+        for c_key in c_keys:
+            ConferenceApi._rebuildSpeakerIndex(c_key)
+            memcache.delete(MEMCACHE_FEATUREDSPEAKER_KEY % c_key.urlsafe())
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/rebuild_featured_speakers'
+                          )
 
-        c_key = ndb.Key(urlsafe=confKey)
-        speakerSessionQuant = Session.query(
-                ancestor=c_key).filter(Session.speaker == speaker).count()
-        if speakerSessionQuant > 1:
-            cacheForm = memcache.get(MEMCACHE_FEATUREDSPEAKER_KEY)
-            # if the input speaker is the featured speaker, we add the session
-            # to the featured sessions list and save it to memcache
-            if cacheForm and cacheForm.featuredSpeaker == speaker:
-                cacheForm.featuredSessions.append(sessionName)
-                memcache.set(MEMCACHE_FEATUREDSPEAKER_KEY, cacheForm)
-            else:
-                # if the input speaker is not featured speaker, we have to
-                # scan the conference and add associated sessions
-                ancestor_key = ndb.Key(urlsafe=confKey)
-                sessions = Session.query(ancestor=ancestor_key).fetch()
-                featuredSessions = []
-                for session in sessions:
-                    if session.speaker == speaker:
-                        featuredSessions.append(session.name)
-                cacheForm = FeaturedSpeakerQueryForm(
-                                featuredSpeaker=speaker,
-                                featuredSessions=featuredSessions
-                                                    )
-                memcache.set(MEMCACHE_FEATUREDSPEAKER_KEY, cacheForm)
-
-api = endpoints.api_server([ConferenceApi])  # register API
+    @staticmethod
+    def _featuredCount(counts):
+        """The count of the speaker to feature: the one with the most
+        sessions, ties going to the first name. None unless someone has
+        more than one session.
+        """
+        counts = [count for count in counts if len(count.sessionNames) > 1]
+        if not counts:
+            return None
+        return min(counts, key=lambda count: (-len(count.sessionNames),
+                                              count.speaker))
+
+    @staticmethod
+    def _indexSpeakers(c_key, sessions):
+        """
+        Count new sessions into the conference's per-speaker index and
+        return the entities to write along with them, the FeaturedSpeaker
+        included if it changes. Must run in the transaction that writes
+        the sessions.
+        """
+        bySpeaker = OrderedDict()
+        for session in sessions:
+            if session.speaker:
+                bySpeaker.setdefault(session.speaker, []).append(
+                    session.name)
+        if not bySpeaker:
+            return []
+
+        featured_key = ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                               parent=c_key)
+        counts = ndb.get_multi([ndb.Key(SpeakerSessionCount, speaker,
+                                        parent=c_key)
+                                for speaker in bySpeaker] + [featured_key])
+        current = counts.pop()
+        for count, (speaker, names) in zip(counts, bySpeaker.items()):
+            if not count:
+                count = SpeakerSessionCount(
+                    key=ndb.Key(SpeakerSessionCount, speaker, parent=c_key),
+                    speaker=speaker)
+            count.sessionNames.extend(names)
+            bySpeaker[speaker] = count
+
+        updated = list(bySpeaker.values())
+        # counts only grow here, so the top of the current featured
+        # speaker and those just counted is the top of them all
+        candidates = list(updated)
+        if current and current.speaker not in bySpeaker:
+            candidates.append(current)
+        top = ConferenceApi._featuredCount(candidates)
+        if top and top is not current:
+            updated.append(FeaturedSpeaker(key=featured_key,
+                                           speaker=top.speaker,
+                                           sessionNames=top.sessionNames))
+        return updated
+
+api = instrument.middleware(profiler.middleware(
+    endpoints.api_server([ConferenceApi])))  # register API
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""etags.py
+
+Udacity conference server-side Python App Engine conditional reads
+
+Conference, Session and Profile carry a version that goes up on every
+put (see models.py). The ETags of getConference, getConferenceSessions
+and getProfile are digests of the entity key(s) and version(s) behind
+the response, so they can be compared without serializing anything.
+
+Endpoints can't answer with a bare 304, so a client passes the ETag it
+holds as ifNoneMatch (or the If-None-Match header, where it gets
+through) and a matching read comes back as an empty form with
+notModified set.
+
+"""
+
+import hashlib
+
+WEAK_PREFIX = 'W/'
+
+
+def _etag(*parts):
+    return '"%s"' % hashlib.sha1(
+        ':'.join(str(part) for part in parts)).hexdigest()
+
+
+def conference(conf):
+    """ETag of a conference as returned, live seat count included."""
+    return _etag(conf.key.urlsafe(), conf.version or 0, conf.seatsAvailable)
+
+
+def sessions(conf_key, sessions):
+    """ETag of all the sessions of a conference. Versions only go up, so
+    any added, changed or deleted session changes the count or the
+    latest version."""
+    return _etag(conf_key.urlsafe(), len(sessions),
+                 max([s.version or 0 for s in sessions] or [0]))
+
+
+def profile(prof):
+    """ETag of a user's profile."""
+    return _etag(prof.key.urlsafe(), prof.version or 0)
+
+
+def matches(etag, ifNoneMatch):
+    """True if an If-None-Match value names etag (weak or not) or is *."""
+    if not ifNoneMatch:
+        return False
+    for tag in ifNoneMatch.split(','):
+        tag = tag.strip()
+        if tag.startswith(WEAK_PREFIX):
+            tag = tag[len(WEAK_PREFIX):]
+        if tag in (etag, '*'):
+            return True
+    return False
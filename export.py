@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Udacity conference server-side Python App Engine bulk export
+
+An export walks every Conference or Session with a query cursor, one
+EXPORT_BATCH_SIZE batch per export_step task. Each batch is written as
+newline-delimited JSON or CSV into an ExportChunk, a child of the
+ExportJob, in the same transaction that advances the job's cursor and
+enqueues the next step. A failed step is retried from the last
+checkpoint, and a repeated one is a no-op, so every row lands exactly
+once and no step holds more than one batch in memory.
+
+The chunks are downloaded one at a time through
+/admin/exports/<id>?chunk=N, whose URLs the job listing gives. An
+export up to MAX_DOWNLOAD_SIZE can also be downloaded whole, in one
+response; App Engine buffers responses, so bigger ones are refused.
+
+"""
+
+import csv
+import json
+from cStringIO import StringIO
+
+from protorpc import messages
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Conference
+from models import ExportChunk
+from models import ExportJob
+from models import RESPONSE_ONLY_FIELDS
+from models import Session
+
+import serializers
+
+EXPORT_BATCH_SIZE = 500
+MAX_DOWNLOAD_SIZE = 16 * 1024 * 1024    # bytes; responses max out at 32MB
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+KINDS = {
+    'Conference': (Conference, serializers.CONFERENCE),
+    'Session': (Session, serializers.SESSION),
+}
+
+
+def _fields(kind):
+    """Message fields exported for kind."""
+    return [f for f in KINDS[kind][1].message.all_fields()
+            if f.name not in RESPONSE_ONLY_FIELDS]
+
+
+def _columns(kind):
+    """Column names of an export of kind."""
+    columns = [f.name for f in _fields(kind)]
+    if kind == 'Session':
+        columns.append('websafeConferenceKey')
+    return columns
+
+
+def _value(value):
+    if isinstance(value, messages.Enum):
+        return value.name
+    return value
+
+
+def _csvValue(value):
+    """A row value as a UTF-8 CSV cell; lists are joined with ';'."""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = u';'.join(value)
+    return unicode(value).encode('utf-8')
+
+
+def _rows(kind, entities):
+    """One dict per entity, keyed by column."""
+    serializer = KINDS[kind][1]
+    fields = _fields(kind)
+    for entity in entities:
+        form = serializer.toForm(entity)
+        row = dict((f.name, _value(getattr(form, f.name))) for f in fields)
+        if kind == 'Session':
+            row['websafeConferenceKey'] = entity.key.parent().urlsafe()
+        yield row
+
+
+def _encode(job, entities):
+    """Return entities as one chunk of the job's format."""
+    out = StringIO()
+    if job.format == 'ndjson':
+        for row in _rows(job.kind, entities):
+            out.write(json.dumps(row, sort_keys=True))
+            out.write('\n')
+        return out.getvalue()
+
+    columns = _columns(job.kind)
+    writer = csv.writer(out)
+    if job.chunks == 0:
+        writer.writerow(columns)
+    for row in _rows(job.kind, entities):
+        writer.writerow([_csvValue(row.get(c)) for c in columns])
+    return out.getvalue()
+
+
+def _enqueueStep(job_key, seq):
+    taskqueue.add(params={'jobId': job_key.id(), 'seq': seq},
+                  url='/tasks/export_step',
+                  transactional=True
+                  )
+
+
+def start(kind, fmt):
+    """Create an ExportJob and enqueue its first step; returns the job.
+    Raises ValueError for an unknown kind or format."""
+    if kind not in KINDS or fmt not in CONTENT_TYPES:
+        raise ValueError('kind must be one of %s and format one of %s' % (
+            ', '.join(sorted(KINDS)), ', '.join(sorted(CONTENT_TYPES))))
+    job_key = ndb.Key(ExportJob, ExportJob.allocate_ids(1)[0])
+
+    @ndb.transactional()
+    def create():
+        job = ExportJob(key=job_key, kind=kind, format=fmt,
+                        status='RUNNING', chunks=0, rows=0, size=0)
+        job.put()
+        _enqueueStep(job_key, 0)
+        return job
+    return create()
+
+
+@ndb.transactional()
+def _checkpoint(job_key, seq, data, rows, cursor, done):
+    """Store chunk seq and move the job on; a no-op if already done."""
+    job = job_key.get()
+    if job.status != 'RUNNING' or job.chunks != seq:
+        return
+    ExportChunk(key=chunkKey(job, seq), data=data).put()
+    job.chunks += 1
+    job.rows += rows
+    job.size = (job.size or 0) + len(data)
+    job.cursor = cursor
+    if done:
+        job.status = 'DONE'
+    else:
+        _enqueueStep(job_key, seq + 1)
+    job.put()
+
+
+def step(jobId, seq):
+    """Export the batch after the job's checkpoint as chunk seq."""
+    job = ExportJob.get_by_id(jobId)
+    if not job or job.status != 'RUNNING' or job.chunks != seq:
+        return
+    model = KINDS[job.kind][0]
+    entities, next_cursor, more = model.query().fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=Cursor(urlsafe=job.cursor))
+    done = not (more and next_cursor)
+    _checkpoint(job.key, seq, _encode(job, entities), len(entities),
+                None if done else next_cursor.urlsafe(), done)
+
+
+def chunkKey(job, seq):
+    """Key of the job's chunk seq."""
+    return ndb.Key(ExportChunk, seq + 1, parent=job.key)
+
+
+def chunkUrls(job):
+    """Download URLs of the job's chunks, in order."""
+    return ['/admin/exports/%d?chunk=%d' % (job.key.id(), seq)
+            for seq in range(job.chunks)]
+
+
+def downloadable(job):
+    """True if the whole export fits in one response; jobs from before
+    sizes were kept only download by chunk."""
+    return job.size is not None and job.size <= MAX_DOWNLOAD_SIZE
+
+
+def chunks(job, batchSize=10):
+    """Yield the data of the job's chunks, in order, batchSize at a time."""
+    for first in range(0, job.chunks, batchSize):
+        for chunk in ndb.get_multi(
+                [chunkKey(job, seq) for seq in
+                 range(first, min(first + batchSize, job.chunks))]):
+            yield chunk.data
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""fulltext.py
+
+Udacity conference server-side Python App Engine full-text search
+
+Conferences (name, description, topics) and sessions (name, highlights,
+speaker) are mirrored into two Search API indexes, one document per
+entity with the entity's websafe key as document id. They're indexed
+right after they're written, and /tasks/reindex_search rebuilds both
+indexes from the datastore.
+
+Besides the text fields, each document has a prefixes field holding the
+leading 2+ characters of every word of its names, so a query for
+"pyth" finds "Python". Results are ranked by match score and paged
+with Search API cursors.
+
+"""
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Conference
+from models import Session
+
+from speakers import normalize
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+MAX_DOCS_PER_PUT = 200      # Search API limit
+MIN_PREFIX = 2
+MAX_PREFIX = 20
+MAX_QUERY_WORDS = 10
+SCORED_RESULTS = 1000       # most matches ranked per query
+REINDEX_BATCH_SIZE = 200
+
+
+def _prefixes(*texts):
+    """Leading MIN_PREFIX..MAX_PREFIX characters of every word."""
+    prefixes = set()
+    for text in texts:
+        for word in normalize(text or '').split():
+            for end in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1):
+                prefixes.add(word[:end])
+    return u' '.join(sorted(prefixes))
+
+
+def _conferenceDocument(conf):
+    topics = u' '.join(conf.topics or [])
+    return search.Document(
+        doc_id=conf.key.urlsafe(),
+        fields=[search.TextField(name='name', value=conf.name),
+                search.TextField(name='description', value=conf.description),
+                search.TextField(name='topics', value=topics),
+                search.TextField(name='prefixes',
+                                 value=_prefixes(conf.name, topics))])
+
+
+def _sessionDocument(session):
+    return search.Document(
+        doc_id=session.key.urlsafe(),
+        fields=[search.TextField(name='name', value=session.name),
+                search.TextField(name='highlights', value=session.highlights),
+                search.TextField(name='speaker', value=session.speaker),
+                search.AtomField(name='conference',
+                                 value=session.key.parent().urlsafe()),
+                search.TextField(name='prefixes',
+                                 value=_prefixes(session.name,
+                                                 session.speaker))])
+
+
+def _put(indexName, documents):
+    index = search.Index(name=indexName)
+    for start in range(0, len(documents), MAX_DOCS_PER_PUT):
+        index.put(documents[start:start + MAX_DOCS_PER_PUT])
+
+
+def indexConferences(confs):
+    """Add or replace the search documents of conferences."""
+    _put(CONFERENCE_INDEX, [_conferenceDocument(c) for c in confs if c])
+
+
+def indexSessions(sessions):
+    """Add or replace the search documents of sessions."""
+    _put(SESSION_INDEX, [_sessionDocument(s) for s in sessions if s])
+
+
+def _queryString(text, conference=None):
+    """Search API query for the words of text, each matching a whole
+    word or a word prefix; words are quoted, so text can't inject
+    query syntax."""
+    words = normalize(text or '').split()[:MAX_QUERY_WORDS]
+    terms = [u'("%s" OR prefixes:"%s")' % (w, w[:MAX_PREFIX]) for w in words]
+    if conference:
+        terms.append(u'conference:"%s"' % conference)
+    return u' AND '.join(terms)
+
+
+def _search(indexName, queryString, pageSize, pageToken):
+    """Return (entity keys, next page token or None) for one page."""
+    query = search.Query(
+        query_string=queryString,
+        options=search.QueryOptions(
+            limit=pageSize,
+            cursor=search.Cursor(web_safe_string=pageToken or None),
+            ids_only=True,
+            sort_options=search.SortOptions(
+                match_scorer=search.MatchScorer(),
+                expressions=[search.SortExpression(
+                    expression='_score',
+                    direction=search.SortExpression.DESCENDING,
+                    default_value=0)],
+                limit=SCORED_RESULTS)))
+    results = search.Index(name=indexName).search(query)
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    return keys, (results.cursor.web_safe_string if results.cursor else None)
+
+
+def searchConferences(text, pageSize, pageToken=None):
+    """Keys of conferences matching text, best first, and the next
+    page token."""
+    if not normalize(text or ''):
+        return [], None
+    return _search(CONFERENCE_INDEX, _queryString(text), pageSize,
+                   pageToken)
+
+
+def searchSessions(text, pageSize, pageToken=None, websafeConferenceKey=None):
+    """Keys of sessions matching text (optionally within one conference),
+    best first, and the next page token."""
+    if not normalize(text or ''):
+        return [], None
+    return _search(SESSION_INDEX,
+                   _queryString(text, websafeConferenceKey),
+                   pageSize, pageToken)
+
+
+def reindex(kind='Conference', websafeCursor=None):
+    """Index a batch of conferences, then sessions; re-enqueues itself
+    until every entity of both kinds has been indexed."""
+    model = Conference if kind == 'Conference' else Session
+    entities, next_cursor, more = model.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=Cursor(urlsafe=websafeCursor))
+    if model is Conference:
+        indexConferences(entities)
+    else:
+        indexSessions(entities)
+
+    if more and next_cursor:
+        taskqueue.add(params={'kind': kind,
+                              'cursor': next_cursor.urlsafe()},
+                      url='/tasks/reindex_search'
+                      )
+    elif model is Conference:
+        taskqueue.add(params={'kind': 'Session'},
+                      url='/tasks/reindex_search'
+                      )
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""instrument.py
+
+Udacity conference server-side Python App Engine per-request RPC stats
+
+middleware() wraps a WSGI app (the Endpoints SPI app and the webapp2
+app) so that, for every request, API proxy hooks count and time the
+RPCs it makes by service and method, failed datastore commits (the
+transactions ndb retries) are counted, and one JSON log line is written
+when the request ends. A client can ask for the summary as a response
+header by sending that header itself, if RPC_STATS_HEADER allows it.
+
+The header only reaches clients of the webapp2 app (main.py). API calls
+go through the Endpoints frontend, which builds its own response from
+the SPI app's body and drops headers like this one, so for those the
+log line is the only record.
+
+Outside an instrumented request the hooks return at once, and inside
+one they only do a few dict updates per RPC, so this stays on in
+production.
+
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from google.appengine.api import apiproxy_stub_map
+
+from settings import RPC_STATS
+from settings import RPC_STATS_HEADER
+
+HEADER = 'X-Rpc-Stats'
+_ENVIRON_HEADER = 'HTTP_X_RPC_STATS'
+
+_local = threading.local()
+
+
+class RequestStats(object):
+    """RPC counts and times of one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.calls = defaultdict(lambda: [0, 0.0])  # service.method: n, secs
+        self.txRetries = 0
+        self._pending = {}
+
+    def started(self, request):
+        self._pending[id(request)] = time.time()
+
+    def finished(self, service, call, request, error):
+        started = self._pending.pop(id(request), None)
+        entry = self.calls['%s.%s' % (service, call)]
+        entry[0] += 1
+        if started is not None:
+            entry[1] += time.time() - started
+        if (error is not None and service == 'datastore_v3' and
+                call == 'Commit'):
+            # ndb retries a transaction whose commit failed
+            self.txRetries += 1
+
+    def summary(self):
+        """Return the stats as a JSON-serializable dict."""
+        return {
+            'request': self.name,
+            'ms': int((time.time() - self.start) * 1000),
+            'rpcs': sum(n for n, _ in self.calls.values()),
+            'rpcMs': int(sum(secs for _, secs in self.calls.values()) * 1000),
+            'calls': dict((name, {'n': n, 'ms': round(secs * 1000, 1)})
+                          for name, (n, secs) in self.calls.items()),
+            'txRetries': self.txRetries,
+        }
+
+    def header(self):
+        """Return a compact one-line summary for the response header."""
+        return 'ms=%d;rpcs=%d;txRetries=%d;%s' % (
+            (time.time() - self.start) * 1000,
+            sum(n for n, _ in self.calls.values()),
+            self.txRetries,
+            ','.join('%s:%d/%.1fms' % (name, n, secs * 1000)
+                     for name, (n, secs) in sorted(self.calls.items())))
+
+
+def current():
+    """The RequestStats of the request on this thread, or None."""
+    return getattr(_local, 'stats', None)
+
+
+def _preCall(service, call, request, response, rpc):
+    stats = current()
+    if stats is not None:
+        stats.started(request)
+
+
+def _postCall(service, call, request, response, rpc, error):
+    stats = current()
+    if stats is not None:
+        stats.finished(service, call, request, error)
+
+
+def _installHooks():
+    """Register the API proxy hooks once per instance."""
+    proxy = apiproxy_stub_map.apiproxy
+    if proxy.GetPreCallHooks().Append('rpc_stats', _preCall):
+        proxy.GetPostCallHooks().Append('rpc_stats', _postCall)
+
+
+def middleware(app):
+    """Wrap a WSGI app with per-request RPC stats."""
+    if not RPC_STATS:
+        return app
+    _installHooks()
+
+    def instrumented(environ, start_response):
+        stats = RequestStats('%s %s' % (environ.get('REQUEST_METHOD'),
+                                        environ.get('PATH_INFO')))
+        wantHeader = RPC_STATS_HEADER and environ.get(_ENVIRON_HEADER)
+
+        def startResponse(status, headers, exc_info=None):
+            if wantHeader:
+                headers = list(headers) + [(HEADER, stats.header())]
+            return start_response(status, headers, exc_info)
+
+        _local.stats = stats
+        try:
+            # both apps call start_response once the handler is done, so
+            # the header covers every RPC the handler made
+            return app(environ, startResponse)
+        finally:
+            _local.stats = None
+            logging.info('rpc_stats %s', json.dumps(stats.summary(),
+                                                    sort_keys=True))
+
+    return instrumented
@@ -11,15 +11,31 @@ wesc+api@google.com (Wesley Chun)
 
 """
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import cache
+import export
+import fulltext
+import instrument
+import profiler
+import seats
+import speakers
+from models import ExportJob
+from models import ProfilerRun
+
+PROFILES_LISTED = 100
+EXPORTS_LISTED = 100
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Reconcile Announcement with seat counts & set in Memcache."""
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
@@ -38,16 +54,290 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
-class AddFeaturedSessionHandler(webapp2.RequestHandler):
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer's new display name onto their conferences."""
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('userId'),
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateOrganizerNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start filling in organizer names on older conferences."""
+        taskqueue.add(url='/tasks/migrate_organizer_names')
+        self.response.set_status(202)
+
+    def post(self):
+        """Fill in organizer names on one batch of conferences."""
+        ConferenceApi._migrateOrganizerNames(
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy live seat count from shards onto the Conference."""
+        seats.syncSeats(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class AdjustSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply a change of conference capacity to its seat shards."""
+        seats.adjustSeats(
+            ndb.Key(urlsafe=self.request.get('websafeConferenceKey')),
+            int(self.request.get('delta')))
+        self.response.set_status(204)
+
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving profiles' registrations onto Registration."""
+        taskqueue.add(url='/tasks/migrate_registrations')
+        self.response.set_status(202)
+
+    def post(self):
+        """Move one batch of profiles' registrations onto Registration."""
+        ConferenceApi._migrateRegistrations(
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class DrainRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Allocate seats to a batch of queued registrations."""
+        ConferenceApi._drainRegistrations(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class ReindexSearchHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start rebuilding the conference and session search indexes."""
+        taskqueue.add(url='/tasks/reindex_search')
+        self.response.set_status(202)
+
+    def post(self):
+        """Index one batch of conferences or sessions."""
+        fulltext.reindex(self.request.get('kind') or 'Conference',
+                         self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class ImportAgendaHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write the next chunk of an agenda import."""
+        ConferenceApi._importAgendaChunk(
+            self.request.get('websafeImportKey'),
+            int(self.request.get('seq')))
+        self.response.set_status(204)
+
+
+class ExportStepHandler(webapp2.RequestHandler):
     def post(self):
-        """Add  current featured speaker"""
-        ConferenceApi.addFeaturedSession(self.request.get('speaker'),
-                                         self.request.get('sessionName'),
-                                         self.request.get('websafeConfKey'))
+        """Export the next batch of an export job."""
+        export.step(int(self.request.get('jobId')),
+                    int(self.request.get('seq')))
         self.response.set_status(204)
 
-app = webapp2.WSGIApplication([
+
+class ExportsHandler(webapp2.RequestHandler):
+    def _jobJson(self, job):
+        return {
+            'id': job.key.id(),
+            'kind': job.kind,
+            'format': job.format,
+            'status': job.status,
+            'chunks': job.chunks,
+            'chunkUrls': export.chunkUrls(job),
+            'rows': job.rows,
+            'size': job.size,
+            'created': job.created.isoformat(),
+        }
+
+    def get(self, jobId=None):
+        """List export jobs, or download one: a single chunk with
+        ?chunk=N (0-based), or the whole output if it's small enough."""
+        if not jobId:
+            jobs = ExportJob.query().order(-ExportJob.created).fetch(
+                EXPORTS_LISTED)
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps([self._jobJson(job)
+                                            for job in jobs]))
+            return
+        job = ExportJob.get_by_id(int(jobId))
+        if not job:
+            self.abort(404)
+        self.response.headers['Content-Type'] = \
+            export.CONTENT_TYPES[job.format]
+        if self.request.get('chunk'):
+            seq = int(self.request.get('chunk'))
+            chunk = export.chunkKey(job, seq).get() \
+                if 0 <= seq < job.chunks else None
+            if not chunk:
+                self.abort(404)
+            self.response.write(chunk.data)
+            return
+        if job.status != 'DONE':
+            self.response.set_status(409)
+            self.response.write('export %d is %s' % (job.key.id(),
+                                                     job.status))
+            return
+        if not export.downloadable(job):
+            self.response.set_status(409)
+            self.response.headers['Content-Type'] = 'text/plain'
+            self.response.write(
+                'export %d is too large to download whole (over %d bytes); '
+                'download its %d chunks with ?chunk=0 to ?chunk=%d' % (
+                    job.key.id(), export.MAX_DOWNLOAD_SIZE, job.chunks,
+                    job.chunks - 1))
+            return
+        self.response.headers['Content-Disposition'] = \
+            'attachment; filename="%s-%d.%s"' % (job.kind.lower(),
+                                                 job.key.id(), job.format)
+        for data in export.chunks(job):
+            self.response.write(data)
+
+    def post(self, jobId=None):
+        """Start an export: kind=Conference|Session, format=ndjson|csv."""
+        try:
+            job = export.start(self.request.get('kind'),
+                               self.request.get('format') or 'ndjson')
+        except ValueError as e:
+            self.response.set_status(400)
+            self.response.write(str(e))
+            return
+        self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(self._jobJson(job)))
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report conference/session cache hit and miss counters."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(cache.stats()))
+
+
+class ReindexConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start re-putting conferences to fill derived properties."""
+        taskqueue.add(url='/tasks/reindex_conferences')
+        self.response.set_status(202)
+
+    def post(self):
+        """Re-put one batch of conferences."""
+        ConferenceApi._reindexConferences(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class ReindexSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start re-putting sessions to fill derived properties."""
+        taskqueue.add(url='/tasks/reindex_sessions')
+        self.response.set_status(202)
+
+    def post(self):
+        """Re-put one batch of sessions."""
+        ConferenceApi._reindexSessions(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class RebuildFeaturedSpeakersHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start rebuilding every conference's featured speaker."""
+        taskqueue.add(url='/tasks/rebuild_featured_speakers')
+        self.response.set_status(202)
+
+    def post(self):
+        """Rebuild the speaker index of one batch of conferences."""
+        ConferenceApi._rebuildFeaturedSpeakers(
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateWishlistsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving profiles' wishlists onto WishlistItem."""
+        taskqueue.add(url='/tasks/migrate_wishlists')
+        self.response.set_status(202)
+
+    def post(self):
+        """Move one batch of profiles' wishlists onto WishlistItem."""
+        ConferenceApi._migrateWishlists(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class IndexSpeakersHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start indexing every existing session by speaker."""
+        taskqueue.add(url='/tasks/index_speakers')
+        self.response.set_status(202)
+
+    def post(self):
+        """Index new sessions, or one batch of existing ones, by speaker."""
+        if self.request.get('websafeConferenceKey'):
+            speakers.indexSessionRange(
+                self.request.get('websafeConferenceKey'),
+                int(self.request.get('first')),
+                int(self.request.get('last')))
+        else:
+            speakers.reindex(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class ProfilesHandler(webapp2.RequestHandler):
+    def get(self, runId=None):
+        """List stored request profiles, or download one: raw pstats
+        data by default, the text summary with ?format=text."""
+        if not runId:
+            runs = ProfilerRun.query().order(-ProfilerRun.created).fetch(
+                PROFILES_LISTED, projection=[ProfilerRun.path,
+                                             ProfilerRun.requestedBy,
+                                             ProfilerRun.created])
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps([{
+                'id': run.key.id(),
+                'path': run.path,
+                'requestedBy': run.requestedBy,
+                'created': run.created.isoformat(),
+            } for run in runs]))
+            return
+        run = ProfilerRun.get_by_id(int(runId))
+        if not run:
+            self.abort(404)
+        if self.request.get('format') == 'text':
+            self.response.headers['Content-Type'] = 'text/plain'
+            self.response.write(run.summary)
+        else:
+            self.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            self.response.headers['Content-Disposition'] = \
+                'attachment; filename="profile-%d.pstats"' % run.key.id()
+            self.response.write(run.stats)
+
+app = instrument.middleware(profiler.middleware(webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/add_featured_session', AddFeaturedSessionHandler)
-], debug=True)
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/migrate_organizer_names', MigrateOrganizerNamesHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/adjust_seats', AdjustSeatsHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/drain_registrations', DrainRegistrationsHandler),
+    ('/tasks/reindex_conferences', ReindexConferencesHandler),
+    ('/tasks/reindex_sessions', ReindexSessionsHandler),
+    ('/tasks/rebuild_featured_speakers', RebuildFeaturedSpeakersHandler),
+    ('/tasks/migrate_wishlists', MigrateWishlistsHandler),
+    ('/tasks/index_speakers', IndexSpeakersHandler),
+    ('/tasks/reindex_search', ReindexSearchHandler),
+    ('/tasks/import_agenda', ImportAgendaHandler),
+    ('/tasks/export_step', ExportStepHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/admin/exports', ExportsHandler),
+    (r'/admin/exports/(\d+)', ExportsHandler),
+    ('/admin/profiles', ProfilesHandler),
+    (r'/admin/profiles/(\d+)', ProfilesHandler)
+], debug=True)))
@@ -15,9 +15,23 @@ wesc+api@google.com (Wesley Chun)
 import httplib
 import endpoints
 from protorpc import messages
+from datetime import time
+from datetime import timedelta
+from time import time as clock
+
 from protorpc import message_types
 from google.appengine.ext import ndb
 
+MAX_ACTIVE_DAYS = 366
+PREFERRED_LATEST_START = time(19, 0)
+RESPONSE_ONLY_FIELDS = ('etag', 'notModified')
+
+
+def _bumpVersion(entity):
+    """Move an entity's version past both its last one and the clock, so
+    versions only go up, even across writers that raced."""
+    entity.version = max((entity.version or 0) + 1, int(clock() * 1000000))
+
 
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
@@ -29,8 +43,12 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionsWishlist = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True)  # legacy
+    sessionsWishlist = ndb.StringProperty(repeated=True)  # legacy
+    version = ndb.IntegerProperty(indexed=False)
+
+    def _pre_put_hook(self):
+        _bumpVersion(self)
 
 
 class ProfileMiniForm(messages.Message):
@@ -44,8 +62,9 @@ class ProfileForm(messages.Message):
     displayName = messages.StringField(1)
     mainEmail = messages.StringField(2)
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
-    conferenceKeysToAttend = messages.StringField(4, repeated=True)
-    sessionsWishlist = messages.StringField(5, repeated=True)
+    # 4 and 5 were conferenceKeysToAttend and sessionsWishlist; don't reuse
+    etag = messages.StringField(6)
+    notModified = messages.BooleanField(7)
 
 
 class StringMessage(messages.Message):
@@ -63,6 +82,7 @@ class Conference(ndb.Model):
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
@@ -70,6 +90,136 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(indexed=False)
+    queuedRegistration = ndb.BooleanProperty(default=False, indexed=False)
+    activeDays      = ndb.DateProperty(repeated=True)
+    version         = ndb.IntegerProperty(indexed=False)
+
+    def _pre_put_hook(self):
+        """Index the conference under every day it runs, so "ongoing on
+        day D" is a single equality query."""
+        _bumpVersion(self)
+        self.activeDays = []
+        if self.startDate:
+            last = max(self.endDate or self.startDate, self.startDate)
+            days = min((last - self.startDate).days + 1, MAX_ACTIVE_DAYS)
+            self.activeDays = [self.startDate + timedelta(days=i)
+                               for i in range(days)]
+
+
+class SpeakerSessionCount(ndb.Model):
+    """SpeakerSessionCount -- a speaker's sessions at a Conference; child
+    of the Conference, keyed by speaker name"""
+    speaker      = ndb.StringProperty()
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- current featured speaker of a Conference"""
+    speaker      = ndb.StringProperty(indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- conferences in the sold out announcement; a
+    single entity, conferences and names are kept in step"""
+    conferences = ndb.KeyProperty(kind='Conference', repeated=True)
+    names       = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class Registration(ndb.Model):
+    """Registration -- a user's seat at a Conference; child of the
+    attendee's Profile, keyed by the Conference's websafe key"""
+    conference = ndb.KeyProperty(kind='Conference')
+    created    = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class RegistrationTicket(ndb.Model):
+    """RegistrationTicket -- a queued request for a seat at a Conference;
+    keyed by conference and user"""
+    conference = ndb.KeyProperty(kind='Conference', indexed=False)
+    profile    = ndb.KeyProperty(kind='Profile', indexed=False)
+    status     = ndb.StringProperty(indexed=False)
+    created    = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class Speaker(ndb.Model):
+    """Speaker -- a speaker's sessions across conferences; keyed by
+    normalized name"""
+    name         = ndb.StringProperty(indexed=False)
+    lookupKeys   = ndb.StringProperty(repeated=True)
+    sessions     = ndb.KeyProperty(kind='Session', repeated=True,
+                                   indexed=False)
+
+
+class WishlistItem(ndb.Model):
+    """WishlistItem -- a Session on a user's wishlist; child of the
+    user's Profile, keyed by the Session's websafe key"""
+    session = ndb.KeyProperty(kind='Session')
+    start   = ndb.DateTimeProperty(indexed=False)
+    end     = ndb.DateTimeProperty(indexed=False)
+
+
+class WishlistSchedule(ndb.Model):
+    """WishlistSchedule -- intervals of a user's wishlisted sessions,
+    sorted by start (see schedule.py); child of the user's Profile"""
+    starts   = ndb.DateTimeProperty(repeated=True, indexed=False)
+    ends     = ndb.DateTimeProperty(repeated=True, indexed=False)
+    maxEnds  = ndb.DateTimeProperty(repeated=True, indexed=False)
+    sessions = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats"""
+    seats = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ProfilerRun(ndb.Model):
+    """ProfilerRun -- cProfile stats of one admin-profiled request"""
+    path         = ndb.StringProperty()
+    requestedBy  = ndb.StringProperty()
+    created      = ndb.DateTimeProperty(auto_now_add=True)
+    wallMs       = ndb.IntegerProperty(indexed=False)
+    stats        = ndb.BlobProperty(compressed=True)    # marshalled pstats
+    summary      = ndb.TextProperty(compressed=True)
+
+
+class AgendaImport(ndb.Model):
+    """AgendaImport -- progress of a bulk session import; child of the
+    Conference"""
+    status         = ndb.StringProperty(indexed=False)
+    totalRows      = ndb.IntegerProperty(indexed=False)
+    importedRows   = ndb.IntegerProperty(indexed=False)
+    chunks         = ndb.IntegerProperty(indexed=False)
+    doneChunks     = ndb.IntegerProperty(indexed=False)
+    firstSessionId = ndb.IntegerProperty(indexed=False)
+    created        = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class AgendaImportChunk(ndb.Model):
+    """AgendaImportChunk -- rows of an AgendaImport written by one task;
+    child of the AgendaImport, keyed by its position plus one"""
+    rows = ndb.TextProperty(compressed=True)    # see agenda.dumps
+    done = ndb.BooleanProperty(default=False, indexed=False)
+
+
+class ExportJob(ndb.Model):
+    """ExportJob -- a bulk export of one kind; checkpoint of its steps"""
+    kind         = ndb.StringProperty()
+    format       = ndb.StringProperty(indexed=False)
+    status       = ndb.StringProperty(indexed=False)
+    cursor       = ndb.StringProperty(indexed=False)
+    chunks       = ndb.IntegerProperty(indexed=False)
+    rows         = ndb.IntegerProperty(indexed=False)
+    size         = ndb.IntegerProperty(indexed=False)  # bytes
+    created      = ndb.DateTimeProperty(auto_now_add=True)
+    updated      = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- one batch of an export's output; child of the
+    ExportJob, keyed by its position plus one"""
+    data         = ndb.BlobProperty(compressed=True)
 
 
 class ConferenceForm(messages.Message):
@@ -86,11 +236,33 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    queuedRegistration = messages.BooleanField(13)
+    etag            = messages.StringField(14)
+    notModified     = messages.BooleanField(15)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    queryPlan = messages.StringField(3)
+
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- state of a queued registration"""
+    QUEUED = 1
+    ALLOCATED = 2   # seat held, registration being written
+    REGISTERED = 3
+    ALREADY_REGISTERED = 4
+    SOLD_OUT = 5
+    CANCELLED = 6   # the conference is gone
+
+
+class RegistrationTicketForm(messages.Message):
+    """RegistrationTicketForm -- queued registration outbound message"""
+    websafeTicketKey = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status = messages.EnumField('RegistrationStatus', 3)
 
 
 class TeeShirtSize(messages.Enum):
@@ -130,6 +302,9 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
+    explain = messages.BooleanField(4)
 
 
 class Session(ndb.Model):
@@ -141,6 +316,16 @@ class Session(ndb.Model):
     typeOfSession   = ndb.StringProperty(default='Unknown')
     date            = ndb.DateProperty()
     startTime       = ndb.TimeProperty()
+    preferred       = ndb.BooleanProperty()
+    version         = ndb.IntegerProperty(indexed=False)
+
+    def _pre_put_hook(self):
+        """Flag non-workshop sessions starting by 7 pm, so preferred
+        sessions are a single equality query."""
+        _bumpVersion(self)
+        self.preferred = bool(self.typeOfSession != 'Workshop' and
+                              self.startTime and
+                              self.startTime <= PREFERRED_LATEST_START)
 
 
 class SessionForm(messages.Message):
@@ -155,15 +340,37 @@ class SessionForm(messages.Message):
     websafeKey      = messages.StringField(8)
 
 
+class AgendaImportForm(messages.Message):
+    """AgendaImportForm -- agenda upload inbound form message"""
+    format = messages.StringField(1)    # csv or json
+    data   = messages.StringField(2)
+
+
+class AgendaImportStatusForm(messages.Message):
+    """AgendaImportStatusForm -- agenda import progress outbound message"""
+    websafeImportKey = messages.StringField(1)
+    status           = messages.StringField(2)
+    totalRows        = messages.IntegerField(3)
+    importedRows     = messages.IntegerField(4)
+
+
 class SessionCreateReturnForm(messages.Message):
     """SessionCreateReturnForm -- Session Create outbnound form message"""
     name              = messages.StringField(1)
     websafeSessionKey = messages.StringField(2)
 
 
+class SessionCreateReturnForms(messages.Message):
+    """SessionCreateReturnForms -- multiple Session Create outbound message"""
+    items = messages.MessageField(SessionCreateReturnForm, 1, repeated=True)
+
+
 class SessionForms(messages.Message):
     """SessionForms -- multiple Conference outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
 
 
 class SessionTypeQueryForm(messages.Message):
@@ -174,17 +381,48 @@ class SessionTypeQueryForm(messages.Message):
 class SessionSpeakerQueryForm(messages.Message):
     """SessionSpeakerQueryForm -- Session query by speaker inbound message"""
     speaker = messages.StringField(1)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
 
 
 class SessionWishlistForm(messages.Message):
     """SessionWishlistForm -- Session wishlist outbound message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class WishlistAddForm(messages.Message):
+    """WishlistAddForm -- outbound message of addSessionToWishlist: if the
+    session was added and which wishlisted sessions it overlaps"""
+    data      = messages.BooleanField(1)
+    conflicts = messages.StringField(2, repeated=True)
+
+
+class WishlistConflictForm(messages.Message):
+    """WishlistConflictForm -- two overlapping wishlisted sessions"""
+    first  = messages.MessageField(SessionForm, 1)
+    second = messages.MessageField(SessionForm, 2)
+
+
+class WishlistConflictForms(messages.Message):
+    """WishlistConflictForms -- overlapping wishlist sessions outbound
+    message"""
+    items = messages.MessageField(WishlistConflictForm, 1, repeated=True)
+
+
+class WishlistUpdateForm(messages.Message):
+    """WishlistUpdateForm -- batch wishlist change in/outbound message"""
+    add    = messages.StringField(1, repeated=True)
+    remove = messages.StringField(2, repeated=True)
 
 
 class SessionDateRangeQueryForm(messages.Message):
     """SessionDateRangeQueryForm -- Session query by date range inbound msg"""
     startDate = messages.StringField(1)
     endDate   = messages.StringField(2)
+    pageSize  = messages.IntegerField(3, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(4)
+    websafeConferenceKey = messages.StringField(5)
 
 
 class FeaturedSpeakerQueryForm(messages.Message):
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine query planner for
+queryConferences
+
+The datastore can only serve a query from built-in (single property)
+indexes if it has equality filters alone (merge-joined) or a single
+inequality field. The planner pushes whichever of those two shapes it
+estimates to be most selective to the datastore and applies every other
+filter to the streamed results in memory, so any combination of
+filters works without a composite index per combination.
+
+"""
+
+import operator
+
+import endpoints
+from google.appengine.ext import ndb
+
+from models import Conference
+
+OPERATORS = {
+            'EQ':   '=',
+            'GT':   '>',
+            'GTEQ': '>=',
+            'LT':   '<',
+            'LTEQ': '<=',
+            'NE':   '!='
+            }
+
+FIELDS = {
+         'CITY': 'city',
+         'TOPIC': 'topics',
+         'MONTH': 'month',
+         'MAX_ATTENDEES': 'maxAttendees',
+         }
+
+INTEGER_FIELDS = ('month', 'maxAttendees')
+
+# rough fraction of conferences that pass a filter, used to rank plans
+EQ_SELECTIVITY = {
+    'city': 0.01,
+    'topics': 0.02,
+    'month': 1 / 12.0,
+    'maxAttendees': 0.05,
+}
+RANGE_SELECTIVITY = 1 / 3.0
+
+_COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+class Filter(object):
+    """One validated filter: field op value."""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def node(self):
+        """Return the filter as a datastore FilterNode."""
+        return ndb.query.FilterNode(self.field, self.op, self.value)
+
+    def matches(self, entity):
+        """Apply the filter in memory with datastore semantics: a missing
+        value never matches, a repeated one matches if any item does.
+        """
+        values = getattr(entity, self.field, None)
+        if not isinstance(values, list):
+            values = [values]
+        compare = _COMPARE[self.op]
+        return any(compare(v, self.value) for v in values if v is not None)
+
+    def __str__(self):
+        return '%s %s %r' % (self.field, self.op, self.value)
+
+
+class QueryPlan(object):
+    """Datastore filters to push down plus in-memory post-filters."""
+
+    def __init__(self, pushed, postFilters, estimate):
+        self.pushed = pushed
+        self.postFilters = postFilters
+        self.estimate = estimate
+        self.scanned = 0
+        self.matched = 0
+
+    def query(self):
+        """Return the datastore query for the pushed-down filters."""
+        q = Conference.query()
+        for f in self.pushed:
+            q = q.filter(f.node())
+        inequality = [f.field for f in self.pushed if f.op != '=']
+        if inequality:
+            # datastore requires sorting on the inequality field first
+            q = q.order(ndb.GenericProperty(inequality[0]))
+        elif not self.pushed:
+            q = q.order(Conference.name)
+        return q
+
+    def matches(self, entity):
+        """True if entity passes every post-filter."""
+        return all(f.matches(entity) for f in self.postFilters)
+
+    def run(self, pageSize, cursor, maxScan):
+        """Stream the query from cursor, keeping matching conferences
+        until pageSize are found or maxScan have been read; returns
+        (conferences, next cursor or None).
+        """
+        results = []
+        it = self.query().iter(start_cursor=cursor, produce_cursors=True,
+                               batch_size=min(pageSize * 2, maxScan))
+        for conf in it:
+            self.scanned += 1
+            if self.matches(conf):
+                results.append(conf)
+            if len(results) >= pageSize or self.scanned >= maxScan:
+                self.matched = len(results)
+                return results, it.cursor_after()
+        self.matched = len(results)
+        return results, None
+
+    def explain(self):
+        """Describe the plan (and what running it cost)."""
+        return ('datastore: %s; post-filter: %s; estimated selectivity '
+                '%.4f; scanned %d, matched %d' % (
+                    ' AND '.join(str(f) for f in self.pushed) or 'all',
+                    ', '.join(str(f) for f in self.postFilters) or 'none',
+                    self.estimate, self.scanned, self.matched))
+
+
+def parseFilters(forms):
+    """Parse, check validity and format user supplied filters."""
+    filters = []
+    for form in forms:
+        try:
+            field = FIELDS[form.field]
+            op = OPERATORS[form.operator]
+        except KeyError:
+            raise endpoints.BadRequestException(
+                "Filter contains invalid field or operator.")
+        value = form.value
+        if field in INTEGER_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Filter value for %s must be an integer." % form.field)
+        filters.append(Filter(field, op, value))
+    return filters
+
+
+def _estimate(filters):
+    """Estimated fraction of conferences that pass all of filters."""
+    estimate = 1.0
+    for f in filters:
+        if f.op == '=':
+            estimate *= EQ_SELECTIVITY.get(f.field, RANGE_SELECTIVITY)
+        elif f.op != '!=':
+            estimate *= RANGE_SELECTIVITY
+    return estimate
+
+
+def plan(forms):
+    """Return the QueryPlan for a list of ConferenceQueryForm filters."""
+    filters = parseFilters(forms)
+
+    # candidate push-downs: all equalities, or all range filters on one
+    # field; "!=" runs as two queries in the datastore so it never is
+    candidates = [[f for f in filters if f.op == '=']]
+    for field in set(f.field for f in filters if f.op not in ('=', '!=')):
+        candidates.append([f for f in filters
+                           if f.field == field and f.op not in ('=', '!=')])
+    candidates = [c for c in candidates if c] or [[]]
+
+    pushed = min(candidates, key=_estimate)
+    postFilters = [f for f in filters if f not in pushed]
+    return QueryPlan(pushed, postFilters, _estimate(filters))
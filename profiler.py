@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""profiler.py
+
+Udacity conference server-side Python App Engine on-demand profiler
+
+middleware() wraps a WSGI app so that a request carrying the X-Profile
+header (or a _profile=1 query parameter) from an admin runs under
+cProfile. The aggregated stats are stored as a ProfilerRun entity, in
+the marshal format pstats reads, together with a text summary; they are
+listed and downloaded through /admin/profiles.
+
+Requests that don't ask for profiling only pay for one header check.
+
+"""
+
+import cProfile
+import logging
+import marshal
+import pstats
+import time
+from cStringIO import StringIO
+
+import endpoints
+from google.appengine.api import oauth
+from google.appengine.api import users
+
+from models import ProfilerRun
+
+from settings import PROFILER_ADMINS
+
+_ENVIRON_HEADER = 'HTTP_X_PROFILE'
+_QUERY_PARAM = '_profile=1'
+SUMMARY_LINES = 40
+
+
+def _requested(environ):
+    """True if the request asks to be profiled."""
+    return bool(environ.get(_ENVIRON_HEADER) or
+                _QUERY_PARAM in environ.get('QUERY_STRING', '').split('&'))
+
+
+def _adminEmail():
+    """Email of the requesting admin, or None if they aren't one. Both
+    cookie (webapp2 pages) and OAuth (Endpoints) sign-in are accepted.
+    """
+    user = users.get_current_user()
+    if user and users.is_current_user_admin():
+        return user.email()
+    if not user:
+        try:
+            user = oauth.get_current_user(endpoints.EMAIL_SCOPE)
+        except oauth.Error:
+            return None
+    if user and user.email().lower() in PROFILER_ADMINS:
+        return user.email()
+    return None
+
+
+def _save(environ, email, prof, elapsed):
+    """Store the profile of one request; returns the ProfilerRun."""
+    out = StringIO()
+    stats = pstats.Stats(prof, stream=out)
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    run = ProfilerRun(
+        path='%s %s' % (environ.get('REQUEST_METHOD'),
+                        environ.get('PATH_INFO')),
+        requestedBy=email,
+        wallMs=int(elapsed * 1000),
+        stats=marshal.dumps(stats.stats),
+        summary=out.getvalue())
+    run.put()
+    return run
+
+
+def middleware(app):
+    """Wrap a WSGI app so admins can profile single requests."""
+
+    def profiled(environ, start_response):
+        if not _requested(environ):
+            return app(environ, start_response)
+        email = _adminEmail()
+        if not email:
+            logging.warning('profiling refused for %s',
+                            environ.get('PATH_INFO'))
+            return app(environ, start_response)
+
+        prof = cProfile.Profile()
+        start = time.time()
+        try:
+            # materialize the body so all the work happens under the profiler
+            return prof.runcall(lambda: list(app(environ, start_response)))
+        finally:
+            try:
+                run = _save(environ, email, prof, time.time() - start)
+                logging.info('profile stored: %s', run.key.id())
+            except Exception:
+                logging.exception('could not store profile')
+
+    return profiled
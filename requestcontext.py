@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""requestcontext.py
+
+Udacity conference server-side Python App Engine per-request state
+
+A RequestContext lives for one API request. It resolves the current
+user, their user id and their Profile at most once, and collects
+modified entities so they can be written with one put_multi.
+
+"""
+
+from collections import OrderedDict
+
+import endpoints
+from google.appengine.ext import ndb
+
+from models import Profile
+from utils import getUserId
+
+_UNSET = object()
+
+
+class RequestContext(object):
+    """Memoized identity and pending writes of one request."""
+
+    def __init__(self):
+        self._user = _UNSET
+        self._userId = None
+        self.profile = None     # set by ConferenceApi._getProfileFromUser
+        self._dirty = OrderedDict()
+
+    @property
+    def user(self):
+        """The signed in user, or None."""
+        if self._user is _UNSET:
+            self._user = endpoints.get_current_user()
+        return self._user
+
+    def requireUser(self):
+        """Return the signed in user; raise if there is none."""
+        if not self.user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return self.user
+
+    @property
+    def userId(self):
+        """The signed in user's id; raises if nobody is signed in."""
+        if self._userId is None:
+            self._userId = getUserId(self.requireUser())
+        return self._userId
+
+    @property
+    def profileKey(self):
+        """Key of the signed in user's Profile."""
+        return ndb.Key(Profile, self.userId)
+
+    def markDirty(self, entity):
+        """Queue entity to be written by the next flush()."""
+        self._dirty[id(entity)] = entity
+
+    def flush(self):
+        """Write every queued entity with one put_multi."""
+        if self._dirty:
+            entities = self._dirty.values()
+            self._dirty.clear()
+            ndb.put_multi(entities)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Udacity conference server-side Python App Engine wishlist schedules
+
+A WishlistSchedule keeps the time intervals of a user's wishlisted
+sessions as parallel lists sorted by start, plus the running maximum of
+their ends. A new interval [start, end) overlaps an existing one iff,
+among the intervals starting before end (found by bisection), the
+latest end is after start, so telling whether an addition conflicts
+takes O(log n). Listing every overlapping pair is one sweep over the
+sorted intervals.
+
+Sessions without a date or start time have no interval and never
+conflict; a session without a duration counts as MIN_DURATION minutes.
+
+"""
+
+import heapq
+from bisect import bisect_left
+from bisect import bisect_right
+from datetime import datetime
+from datetime import timedelta
+
+MIN_DURATION = 1    # minutes
+
+
+def interval(session):
+    """Return (start, end) datetimes of a session, or None."""
+    if not session or not session.date or not session.startTime:
+        return None
+    start = datetime.combine(session.date, session.startTime)
+    return start, start + timedelta(
+        minutes=max(session.duration or 0, MIN_DURATION))
+
+
+def _refreshMaxEnds(sched, first):
+    """Recompute the running maximum of ends from position first on."""
+    del sched.maxEnds[first:]
+    latest = sched.maxEnds[-1] if sched.maxEnds else None
+    for end in sched.ends[first:]:
+        latest = end if latest is None or end > latest else latest
+        sched.maxEnds.append(latest)
+
+
+def remove(sched, s_key):
+    """Take a session out of the schedule, if it's in it."""
+    if s_key not in sched.sessions:
+        return
+    i = sched.sessions.index(s_key)
+    del sched.starts[i], sched.ends[i], sched.sessions[i]
+    _refreshMaxEnds(sched, i)
+
+
+def insert(sched, s_key, start, end):
+    """Put a session's interval into the schedule, keeping it sorted."""
+    remove(sched, s_key)
+    i = bisect_right(sched.starts, start)
+    sched.starts.insert(i, start)
+    sched.ends.insert(i, end)
+    sched.sessions.insert(i, s_key)
+    _refreshMaxEnds(sched, i)
+
+
+def overlapping(sched, start, end):
+    """Keys of the sessions overlapping [start, end); O(log n) when
+    there are none, plus time proportional to the span scanned."""
+    k = bisect_left(sched.starts, end)
+    overlaps = []
+    # maxEnds is non-decreasing, so once it's not after start no
+    # earlier interval can reach start either
+    for j in range(k - 1, -1, -1):
+        if sched.maxEnds[j] <= start:
+            break
+        if sched.ends[j] > start:
+            overlaps.append(sched.sessions[j])
+    overlaps.reverse()
+    return overlaps
+
+
+def conflicts(sched):
+    """Every overlapping pair of sessions, as (earlier, later) keys, in
+    one sweep by start keeping the still running intervals in a heap."""
+    pairs = []
+    running = []    # (end, position)
+    for i, start in enumerate(sched.starts):
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for _, j in sorted(running, key=lambda r: r[1]):
+            pairs.append((sched.sessions[j], sched.sessions[i]))
+        heapq.heappush(running, (sched.ends[i], i))
+    return pairs
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat counter
+
+Seats for a conference are spread over SeatShard entities, each in its own
+entity group, so concurrent registrations for one conference commit
+against different shards instead of all contending on the Conference.
+A shard never goes below zero, so the conference can't be oversold.
+
+Conference.seatsAvailable is kept as a lagging snapshot (synced by the
+sync_seats task) for index queries; readers that need the live number
+go through refreshSeatsAvailable(), which is served from memcache.
+
+"""
+
+import logging
+import random
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+import cache
+
+NUM_SHARDS = 20
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+MEMCACHE_SEATS_SYNC_KEY = "SEATS_SYNC:%s"
+SEATS_CACHE_TTL = 60        # seconds; bounds drift of the cached total
+SEATS_SYNC_DELAY = 30       # seconds between Conference snapshot writes
+MAX_CLAIMS_PER_TXN = 24     # plus the shard: the XG limit of 25 groups
+
+
+def _shardKeys(conf_key, numShards):
+    """Return the SeatShard keys of a conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i))
+            for i in range(numShards)]
+
+
+def shardKeys(conf):
+    """Return the SeatShard keys of a sharded conference."""
+    return _shardKeys(conf.key, conf.seatShards)
+
+
+def createShards(conf, seats):
+    """Split seats over new (unsaved) SeatShards and mark conf as sharded."""
+    numShards = max(1, min(NUM_SHARDS, seats))
+    base, extra = divmod(seats, numShards)
+    conf.seatShards = numShards
+    return [SeatShard(key=key, seats=base + (1 if i < extra else 0))
+            for i, key in enumerate(_shardKeys(conf.key, numShards))]
+
+
+@ndb.transactional(xg=True)
+def _shardConference(conf_key):
+    """Move seatsAvailable of a pre-sharding conference onto shards."""
+    conf = conf_key.get()
+    if not conf.seatShards:
+        shards = createShards(conf, conf.seatsAvailable or 0)
+        ndb.put_multi([conf] + shards)
+    return conf
+
+
+def ensureShards(conf):
+    """Return conf, creating its shards first if it predates sharding."""
+    if conf.seatShards:
+        return conf
+    conf = _shardConference(conf.key)
+    cache.invalidate(conf.key)
+    return conf
+
+
+@ndb.transactional(xg=True)
+def _changeShard(shard_key, delta, callback=None):
+    """Add delta seats to one shard.
+
+    callback() runs in the same transaction; if it returns False nothing
+    is written. Returns True if applied, False if the shard doesn't have
+    enough seats, None if callback declined.
+    """
+    shard = shard_key.get()
+    if shard.seats + delta < 0:
+        return False
+    if callback and not callback():
+        return None
+    shard.seats += delta
+    shard.put()
+    return True
+
+
+def _seatsChanged(conf_key, delta):
+    """Adjust the cached total and schedule a Conference snapshot sync."""
+    wsck = conf_key.urlsafe()
+    if delta > 0:
+        memcache.incr(MEMCACHE_SEATS_KEY % wsck, delta)
+    elif delta < 0:
+        memcache.decr(MEMCACHE_SEATS_KEY % wsck, -delta)
+    # at most one pending sync per conference
+    if memcache.add(MEMCACHE_SEATS_SYNC_KEY % wsck, 1, time=SEATS_SYNC_DELAY):
+        taskqueue.add(params={'websafeConferenceKey': wsck},
+                      url='/tasks/sync_seats',
+                      countdown=SEATS_SYNC_DELAY
+                      )
+
+
+def takeSeat(conf, callback=None):
+    """Take one seat of a sharded conference.
+
+    callback() runs inside the seat transaction (see _changeShard) and may
+    raise to abort. Returns False if the conference is sold out.
+    """
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf))
+              if shard and shard.seats > 0]
+    random.shuffle(shards)
+    for shard in shards:
+        result = _changeShard(shard.key, -1, callback)
+        if result:
+            _seatsChanged(conf.key, -1)
+            return True
+        if result is None:
+            return False
+    return False
+
+
+def releaseSeat(conf, callback=None):
+    """Give one seat back; returns False if callback declined."""
+    if _changeShard(random.choice(shardKeys(conf)), 1, callback):
+        _seatsChanged(conf.key, 1)
+        return True
+    return False
+
+
+@ndb.transactional(xg=True)
+def _claimSeats(shard_key, keys, claim):
+    shard = shard_key.get()
+    claimed = claim(ndb.get_multi(keys), shard.seats)
+    if claimed:
+        shard.seats -= len(claimed)
+        ndb.put_multi([shard] + claimed)
+    return claimed, shard.seats == 0
+
+
+def takeSeatsFor(conf, keys, claim):
+    """Take seats of a sharded conference for many entities at once.
+
+    The entities of keys go, at most MAX_CLAIMS_PER_TXN at a time, into
+    an XG transaction with one shard, where claim(entities, seats) marks
+    up to seats of them as holding a seat and returns those; they're
+    written with the shard, so a seat and its holder commit together.
+    Returns every claimed entity.
+    """
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf))
+              if shard and shard.seats > 0]
+    random.shuffle(shards)
+    claimed, remaining = [], list(keys)
+    for shard in shards:
+        while remaining:
+            batch = remaining[:MAX_CLAIMS_PER_TXN]
+            got, empty = _claimSeats(shard.key, batch, claim)
+            claimed.extend(got)
+            if empty:
+                # retry the rest of this batch on the next shard
+                taken = set(entity.key for entity in got)
+                remaining = [key for key in remaining if key not in taken]
+                break
+            remaining = remaining[len(batch):]
+    if claimed:
+        _seatsChanged(conf.key, -len(claimed))
+    return claimed
+
+
+def adjustSeats(conf_key, delta):
+    """Add or remove delta seats; returns False, changing nothing, if
+    more seats are to be removed than are free. Seats taken while they
+    are being removed are kept, so a shard never goes below zero.
+    """
+    conf = conf_key.get()
+    if not conf or not delta:
+        return bool(conf)
+    conf = ensureShards(conf)
+    if delta > 0:
+        _changeShard(random.choice(shardKeys(conf)), delta)
+        _seatsChanged(conf.key, delta)
+        return True
+    remaining = -delta
+    shards = ndb.get_multi(shardKeys(conf))
+    free = sum(shard.seats for shard in shards if shard)
+    if remaining > free:
+        logging.warning('not removing %d seats of %s: only %d are free',
+                        remaining, conf_key.urlsafe(), free)
+        return False
+    for shard in shards:
+        if not remaining:
+            break
+        take = min(shard.seats, remaining)
+        if take and _changeShard(shard.key, -take):
+            _seatsChanged(conf.key, -take)
+            remaining -= take
+    return True
+
+
+def refreshSeatsAvailable(confs):
+    """Replace seatsAvailable (in memory only) with the live shard total
+    for every sharded conference in confs; returns confs.
+    """
+    sharded = {}
+    for conf in confs:
+        if conf and conf.seatShards:
+            sharded.setdefault(MEMCACHE_SEATS_KEY % conf.key.urlsafe(),
+                               []).append(conf)
+    if not sharded:
+        return confs
+
+    cached = memcache.get_multi(sharded.keys())
+    missing = [k for k in sharded if k not in cached]
+    if missing:
+        # one get_multi for the shards of every uncached conference
+        keys = []
+        for k in missing:
+            keys.extend(shardKeys(sharded[k][0]))
+        shards = dict((shard.key, shard.seats)
+                      for shard in ndb.get_multi(keys) if shard)
+        for k in missing:
+            cached[k] = sum(shards.get(key, 0)
+                            for key in shardKeys(sharded[k][0]))
+        memcache.set_multi(dict((k, cached[k]) for k in missing),
+                           time=SEATS_CACHE_TTL)
+
+    for k, seats in cached.items():
+        for conf in sharded[k]:
+            conf.seatsAvailable = seats
+    return confs
+
+
+@ndb.transactional()
+def _writeSnapshot(conf_key, seats):
+    conf = conf_key.get()
+    if conf and conf.seatsAvailable != seats:
+        conf.seatsAvailable = seats
+        conf.put()
+        return True
+    return False
+
+
+def syncSeats(websafeConferenceKey):
+    """Copy the live shard total onto Conference.seatsAvailable."""
+    conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return
+    memcache.delete(MEMCACHE_SEATS_KEY % websafeConferenceKey)
+    refreshSeatsAvailable([conf])
+    if _writeSnapshot(conf_key, conf.seatsAvailable):
+        cache.invalidate(conf_key)
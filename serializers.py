@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Udacity conference server-side Python App Engine entity -> ProtoRPC
+message serializers
+
+Each Serializer works out, once at import time, which message fields
+come from which model properties and how to convert them (dates and
+times to strings, enum names to Enum values, the entity key to
+websafeKey). Serializing an entity then is a straight run over that
+plan, with no per-entity field introspection.
+
+"""
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+
+_registry = {}
+
+
+def _identity(value):
+    return value
+
+
+def _toString(value):
+    return None if value is None else str(value)
+
+
+def _enumConverter(enumType):
+    """Return a converter from an enum name to enumType's value."""
+    byName = dict((e.name, e) for e in enumType)
+    return byName.get
+
+
+def _websafeKey(entity):
+    return entity.key.urlsafe()
+
+
+class Serializer(object):
+    """Copies one model's entities into one message class."""
+
+    def __init__(self, model, message, extra=None):
+        """extra maps message field names to functions of the entity, for
+        fields that aren't a model property of the same name."""
+        self.message = message
+        extra = dict({'websafeKey': _websafeKey}, **(extra or {}))
+        self.properties = []    # (field name, property name, converter)
+        self.computed = []      # (field name, function of entity)
+        for field in message.all_fields():
+            name = field.name
+            prop = model._properties.get(name)
+            if prop is not None:
+                self.properties.append(
+                    (name, prop._code_name, self._converter(field, prop)))
+            elif name in extra:
+                self.computed.append((name, extra[name]))
+
+    @staticmethod
+    def _converter(field, prop):
+        """Pick the conversion from prop's values to field's values."""
+        if isinstance(field, messages.EnumField):
+            return _enumConverter(field.type)
+        if (isinstance(field, messages.StringField) and
+                isinstance(prop, ndb.DateTimeProperty)):
+            return _toString
+        return _identity
+
+    def toForm(self, entity):
+        """Return entity copied into a new message."""
+        form = self.message()
+        for name, attr, convert in self.properties:
+            value = getattr(entity, attr)
+            if value is not None and value != []:
+                if convert is not _identity:
+                    value = convert(value)
+                setattr(form, name, value)
+        for name, compute in self.computed:
+            setattr(form, name, compute(entity))
+        return form
+
+    def toForms(self, entities):
+        """Return a list of messages, one per entity."""
+        toForm = self.toForm
+        return [toForm(entity) for entity in entities]
+
+
+def register(model, message, extra=None):
+    """Build and register the Serializer for a model/message pair."""
+    serializer = Serializer(model, message, extra)
+    _registry[(model, message)] = serializer
+    return serializer
+
+
+def get(model, message):
+    """Return the registered Serializer for a model/message pair."""
+    return _registry[(model, message)]
+
+
+CONFERENCE = register(Conference, ConferenceForm)
+SESSION = register(Session, SessionForm)
+PROFILE = register(Profile, ProfileForm)
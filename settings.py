@@ -16,3 +16,16 @@ WEB_CLIENT_ID = '86908364842-sk7dtpvg5of9fr95pmgkndcg9r1t4osv.apps.googleusercon
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Set to True to let queryConferences return its query plan when asked.
+QUERY_EXPLAIN = False
+
+# Log RPC counts and times of every request (see instrument.py), and let
+# clients ask for them in an X-Rpc-Stats response header (main.py
+# handlers only; the Endpoints frontend drops it from API responses).
+RPC_STATS = True
+RPC_STATS_HEADER = False
+
+# Emails (lower case) allowed to profile a request with an X-Profile
+# header or _profile=1 parameter; app admins always are.
+PROFILER_ADMINS = []
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Udacity conference server-side Python App Engine speaker index
+
+Each speaker is a Speaker entity keyed by their normalized name, holding
+the keys of all their sessions across conferences. Speakers are looked
+up by normalized name through lookupKeys, which also holds the name with
+given names shortened to initials, so "J. Smith" finds "John Smith".
+The other way round, "John Smith" also finds the speaker whose name is
+exactly "J. Smith", but not "Jane Smith".
+
+Sessions are added to the index by the index_speakers task, enqueued in
+the same transaction that writes them.
+
+"""
+
+import re
+import unicodedata
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Session
+from models import Speaker
+
+INDEX_BATCH_SIZE = 100
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(name):
+    """Lower case name with accents and punctuation dropped."""
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8')
+    name = unicodedata.normalize('NFKD', name)
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    return u' '.join(_NON_WORD.sub(u' ', name.lower()).split())
+
+
+def lookupKeys(name):
+    """Normalized forms a speaker can be looked up by: the full name and,
+    for names of more than one word, initials plus the last word.
+    """
+    full = normalize(name)
+    words = full.split()
+    keys = [full]
+    if len(words) > 1:
+        short = u' '.join([w[0] for w in words[:-1]] + words[-1:])
+        if short != full:
+            keys.append(short)
+    return keys
+
+
+@ndb.transactional()
+def _addSessions(name, s_keys):
+    """Add session keys to one speaker, creating the Speaker if new."""
+    key = ndb.Key(Speaker, normalize(name))
+    speaker = key.get() or Speaker(key=key, name=name,
+                                   lookupKeys=lookupKeys(name))
+    known = set(speaker.sessions)
+    new = [s_key for s_key in s_keys if s_key not in known]
+    if new:
+        speaker.sessions.extend(new)
+        speaker.put()
+
+
+def indexSessions(sessions):
+    """Add sessions to their speakers' entries; safe to repeat."""
+    bySpeaker = {}
+    for session in sessions:
+        if session and session.speaker and normalize(session.speaker):
+            entry = bySpeaker.setdefault(normalize(session.speaker),
+                                         (session.speaker, []))
+            entry[1].append(session.key)
+    for name, s_keys in bySpeaker.values():
+        _addSessions(name, s_keys)
+
+
+def enqueueIndex(c_key, first, last):
+    """Schedule indexing of the sessions with ids first..last of a
+    conference; call inside the transaction that writes them.
+    """
+    taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe(),
+                          'first': first,
+                          'last': last},
+                  url='/tasks/index_speakers',
+                  transactional=True
+                  )
+
+
+def indexSessionRange(websafeConferenceKey, first, last):
+    """Index the sessions with ids first..last of a conference."""
+    c_key = ndb.Key(urlsafe=websafeConferenceKey)
+    indexSessions(ndb.get_multi([ndb.Key(Session, s_id, parent=c_key)
+                                 for s_id in range(first, last + 1)]))
+
+
+def reindex(websafeCursor=None):
+    """Index a batch of existing sessions; re-enqueues itself until
+    every session has been visited.
+    """
+    sessions, next_cursor, more = Session.query().fetch_page(
+        INDEX_BATCH_SIZE, start_cursor=Cursor(urlsafe=websafeCursor))
+    indexSessions(sessions)
+
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/index_speakers'
+                      )
+
+
+def sessionKeys(name):
+    """Keys of the sessions of every speaker name refers to."""
+    keys = lookupKeys(name)
+    if not keys[0]:
+        return []
+    found = Speaker.query(Speaker.lookupKeys == keys[0]).fetch()
+    # a full name also finds the speaker known only by its initials
+    found.extend(speaker for speaker in ndb.get_multi(
+        [ndb.Key(Speaker, key) for key in keys[1:]]) if speaker)
+    s_keys, seen = [], set()
+    for speaker in found:
+        for s_key in speaker.sessions:
+            if s_key not in seen:
+                seen.add(s_key)
+                s_keys.append(s_key)
+    return s_keys
@@ -130,3 +130,35 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name conditionalGet
+ *
+ * @description
+ * Calls a read method of the conference API with the ETag of its last
+ * result for the same parameters, and hands back that cached result when
+ * the server answers notModified.
+ *
+ */
+app.factory('conditionalGet', function () {
+    var results = {};
+
+    return function (method, params, callback) {
+        var cacheKey = method + ':' + JSON.stringify(params || {});
+        var cached = results[cacheKey];
+        var request = angular.extend({}, params);
+        if (cached) {
+            request.ifNoneMatch = cached.etag;
+        }
+        gapi.client.conference[method](request).execute(function (resp) {
+            if (!resp.error && resp.result && resp.result.notModified && cached) {
+                resp.result = cached;
+            } else if (!resp.error && resp.result && resp.result.etag) {
+                results[cacheKey] = resp.result;
+            }
+            callback(resp);
+        });
+    };
+});
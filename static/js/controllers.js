@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conditionalGet, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,8 +63,8 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
+                conditionalGet('getProfile', {},
+                    function (resp) {
                         $scope.$apply(function () {
                             $scope.loading = false;
                             if (resp.error) {
@@ -414,6 +414,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.nextPageToken = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -423,10 +424,42 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Fetches the next page of the current tab's conferences and appends it.
+     */
+    $scope.loadMoreConferences = function () {
+        if (!$scope.nextPageToken || pageTab != $scope.selectedTab) {
+            return;
+        }
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll($scope.nextPageToken);
+        } else if ($scope.selectedTab == 'YOU_WILL_ATTEND') {
+            $scope.getConferencesAttend($scope.nextPageToken);
+        }
+    };
+
+    /**
+     * Replaces the listed conferences with a first page, or appends a
+     * later one, and remembers the token of the page after it.
+     */
+    var pageTab = null;
+    var showPage = function (resp, pageToken) {
+        if (!pageToken) {
+            $scope.conferences = [];
+        }
+        angular.forEach(resp.result.items || [], function (conference) {
+            $scope.conferences.push(conference);
+        });
+        $scope.nextPageToken = resp.result.nextPageToken || null;
+        pageTab = $scope.selectedTab;
+    };
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param pageToken the nextPageToken of the previous page, if any
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (pageToken) {
         var sendFilters = {
             filters: []
         }
@@ -440,6 +473,9 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
+        if (pageToken) {
+            sendFilters.pageToken = pageToken;
+        }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
@@ -458,10 +494,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                        showPage(resp, pageToken);
                     }
                     $scope.submitted = true;
                 });
@@ -508,10 +541,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     /**
      * Retrieves the conferences to attend by calling the conference.getProfile method and
      * invokes the conference.getConference method n times where n == the number of the conferences to attend.
+     *
+     * @param pageToken the nextPageToken of the previous page, if any
      */
-    $scope.getConferencesAttend = function () {
+    $scope.getConferencesAttend = function (pageToken) {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        gapi.client.conference.getConferencesToAttend(
+            pageToken ? {pageToken: pageToken} : {}).
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -527,7 +563,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         }
                     } else {
                         // The request has succeeded.
-                        $scope.conferences = resp.result.items;
+                        showPage(resp, pageToken);
                         $scope.loading = false;
                         $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
                         $scope.alertStatus = 'success';
@@ -547,7 +583,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $timeout, oauth2Provider, conditionalGet, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -559,9 +595,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conditionalGet('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -581,31 +617,99 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        gapi.client.conference.getRegistrationStatus({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
+                    // Failed to get the registration status.
+                } else if (resp.data) {
+                    // The user is attending the conference.
+                    $scope.alertStatus = 'info';
+                    $scope.messages = 'You are attending this conference';
+                    $scope.isUserAttending = true;
+                }
+            });
+        });
+    };
+
+
+    /**
+     * Milliseconds between polls of a queued registration ticket.
+     */
+    var TICKET_POLL_INTERVAL = 2000;
+
+    /**
+     * Shows the outcome of a queued registration ticket, polling it
+     * through conference.getRegistrationTicket until it is decided.
+     */
+    var followTicket = function (ticket) {
+        if (ticket.status == 'QUEUED' || ticket.status == 'ALLOCATED') {
+            $scope.messages = 'Your registration is queued';
+            $scope.alertStatus = 'info';
+            $timeout(function () {
+                gapi.client.conference.getRegistrationTicket({
+                    websafeTicketKey: ticket.websafeTicketKey
+                }).execute(function (resp) {
+                    $scope.$apply(function () {
+                        if (resp.error) {
+                            $scope.messages = 'Failed to get the registration status : ' +
+                                (resp.error.message || '');
+                            $scope.alertStatus = 'warning';
+                            $log.error($scope.messages);
+                        } else {
+                            followTicket(resp.result);
                         }
+                    });
+                });
+            }, TICKET_POLL_INTERVAL);
+        } else if (ticket.status == 'REGISTERED' || ticket.status == 'ALREADY_REGISTERED') {
+            $scope.messages = 'Registered for the conference';
+            $scope.alertStatus = 'success';
+            $scope.isUserAttending = true;
+        } else if (ticket.status == 'SOLD_OUT') {
+            $scope.messages = 'There are no seats available.';
+            $scope.alertStatus = 'warning';
+        } else {
+            $scope.messages = 'Failed to register for the conference';
+            $scope.alertStatus = 'warning';
+        }
+    };
+
+    /**
+     * Invokes the conference.requestRegistration method, for conferences in queued registration mode.
+     */
+    var requestRegistration = function () {
+        $scope.loading = true;
+        gapi.client.conference.requestRegistration({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to register for the conference : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
                     }
+                } else {
+                    followTicket(resp.result);
                 }
             });
         });
     };
 
-
     /**
      * Invokes the conference.registerForConference method.
      */
     $scope.registerForConference = function () {
+        if ($scope.conference.queuedRegistration) {
+            requestRegistration();
+            return;
+        }
         $scope.loading = true;
         gapi.client.conference.registerForConference({
             websafeConferenceKey: $routeParams.websafeConferenceKey
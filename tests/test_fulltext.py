@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""test_fulltext.py
+
+Tests of full-text search (fulltext.py) against the testbed's local
+Search API stub.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import fulltext
+from models import Conference
+from models import Profile
+from models import Session
+
+ORGANIZER = ndb.Key(Profile, 'organizer@example.com')
+
+
+class FullTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_search_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def conference(self, c_id, name, topics=()):
+        conf = Conference(key=ndb.Key(Conference, c_id, parent=ORGANIZER),
+                          name=name, description=name, topics=list(topics))
+        fulltext.indexConferences([conf])
+        return conf
+
+    def search(self, text, pageSize=10, pageToken=None):
+        return fulltext.searchConferences(text, pageSize, pageToken)
+
+    def testPrefixMatchesWordStarts(self):
+        python = self.conference(1, 'Python Summit', ['Programming'])
+        self.conference(2, 'Cloud Expo')
+
+        for text in ('pyth', 'PYTHON', 'sum', 'progr', 'python summ'):
+            keys, _ = self.search(text)
+            self.assertEqual(keys, [python.key], text)
+        # prefixes are word starts only, and of at least MIN_PREFIX chars
+        for text in ('ython', 'p', 'java'):
+            keys, _ = self.search(text)
+            self.assertEqual(keys, [], text)
+
+    def testUserInputIsQuoted(self):
+        self.assertEqual(
+            fulltext._queryString(u'py" OR name:(x'),
+            u'("py" OR prefixes:"py") AND ("or" OR prefixes:"or") AND '
+            u'("name" OR prefixes:"name") AND ("x" OR prefixes:"x")')
+
+        self.conference(1, 'Python Summit')
+        # operators in the input are plain words, not query syntax
+        for text in ('python OR java', 'python) OR (java', 'NOT python',
+                     'name:"python'):
+            keys, _ = self.search(text)
+            self.assertEqual(keys, [], text)
+        for text in ('"python"', 'python\\', '(python'):
+            keys, _ = self.search(text)
+            self.assertEqual(keys, [ndb.Key(Conference, 1,
+                                            parent=ORGANIZER)], text)
+        self.assertEqual(self.search('  ?!  '), ([], None))
+
+    def testSessionsWithinOneConference(self):
+        c_keys = [ndb.Key(Conference, c_id, parent=ORGANIZER)
+                  for c_id in (1, 2)]
+        sessions = [Session(key=ndb.Key(Session, 1, parent=c_key),
+                            name='Intro to Python', speaker='Ada Lovelace')
+                    for c_key in c_keys]
+        fulltext.indexSessions(sessions)
+
+        keys, _ = fulltext.searchSessions('lovel', 10)
+        self.assertEqual(sorted(keys), sorted(s.key for s in sessions))
+        keys, _ = fulltext.searchSessions('intro', 10, None,
+                                          c_keys[1].urlsafe())
+        self.assertEqual(keys, [sessions[1].key])
+
+    def testCursorPaging(self):
+        confs = [self.conference(c_id, 'Cloud Conference %d' % c_id)
+                 for c_id in range(1, 6)]
+
+        found, pageToken, pages = [], None, 0
+        while True:
+            keys, pageToken = self.search('cloud', 2, pageToken)
+            pages += 1
+            self.assertTrue(len(keys) <= 2)
+            found.extend(keys)
+            if not pageToken or pages > len(confs):
+                break
+        self.assertEqual(len(found), len(confs))
+        self.assertEqual(set(found), set(conf.key for conf in confs))
+
+
+if __name__ == '__main__':
+    unittest.main()
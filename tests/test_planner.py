@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""test_planner.py
+
+Tests of the queryConferences planner (planner.py) on the App Engine
+testbed stubs: whatever it pushes down, paging through a plan finds the
+same conferences as filtering them all in Python.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import operator
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import planner
+from models import Conference
+from models import ConferenceQueryForm
+from models import Profile
+
+ORGANIZER = ndb.Key(Profile, 'organizer@example.com')
+CITIES = ('London', 'Paris', 'Tokyo', None)
+TOPICS = ('Web', 'Cloud', 'Mobile')
+ATTENDEES = (10, 50, 100, 500, None)
+
+NAIVE = {
+    'EQ': operator.eq,
+    'NE': operator.ne,
+    'GT': operator.gt,
+    'GTEQ': operator.ge,
+    'LT': operator.lt,
+    'LTEQ': operator.le,
+}
+
+
+def naiveMatch(conf, field, op, value):
+    """A filter the slow way; a missing value never matches and a
+    repeated one matches if any of its items does."""
+    values = getattr(conf, planner.FIELDS[field])
+    if not isinstance(values, list):
+        values = [values]
+    if field in ('MONTH', 'MAX_ATTENDEES'):
+        value = int(value)
+    return any(NAIVE[op](v, value) for v in values if v is not None)
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+        self.confs = [Conference(
+            key=ndb.Key(Conference, i, parent=ORGANIZER),
+            name='Conference %02d' % i,
+            city=CITIES[i % len(CITIES)],
+            topics=[t for j, t in enumerate(TOPICS) if (i >> j) & 1],
+            month=i % 12 + 1,
+            maxAttendees=ATTENDEES[i % len(ATTENDEES)])
+            for i in range(1, 61)]
+        ndb.put_multi(self.confs)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def runPlan(self, filters, pageSize=3, maxScan=5):
+        """Page through a fresh plan for filters; returns every key."""
+        forms = [ConferenceQueryForm(field=field, operator=op, value=value)
+                 for field, op, value in filters]
+        found, cursor = [], None
+        for page in range(len(self.confs) + 1):
+            confs, cursor = planner.plan(forms).run(pageSize, cursor,
+                                                    maxScan)
+            self.assertTrue(len(confs) <= pageSize)
+            found.extend(conf.key for conf in confs)
+            if not cursor:
+                return found
+        self.fail('paging did not finish: %r' % (filters,))
+
+    def testMatchesNaiveFilter(self):
+        for filters in (
+                [],
+                [('CITY', 'EQ', 'London')],
+                [('CITY', 'EQ', 'London'), ('TOPIC', 'EQ', 'Web')],
+                [('MONTH', 'GT', '3'), ('MAX_ATTENDEES', 'LTEQ', '50')],
+                [('CITY', 'EQ', 'Paris'), ('MONTH', 'GTEQ', '6'),
+                 ('MONTH', 'LT', '10')],
+                [('TOPIC', 'NE', 'Web')],
+                [('MAX_ATTENDEES', 'NE', '100'), ('CITY', 'EQ', 'Tokyo')],
+                [('CITY', 'NE', 'London'), ('MAX_ATTENDEES', 'GT', '10'),
+                 ('TOPIC', 'EQ', 'Cloud')],
+                ):
+            expected = [conf.key for conf in self.confs
+                        if all(naiveMatch(conf, *f) for f in filters)]
+            found = self.runPlan(filters)
+            self.assertEqual(len(found), len(set(found)), filters)
+            self.assertEqual(set(found), set(expected), filters)
+
+    def testPushesMostSelective(self):
+        forms = [ConferenceQueryForm(field='CITY', operator='EQ',
+                                     value='London'),
+                 ConferenceQueryForm(field='MONTH', operator='GT',
+                                     value='3')]
+        plan = planner.plan(forms)
+        self.assertEqual([f.field for f in plan.pushed], ['city'])
+        self.assertEqual([f.field for f in plan.postFilters], ['month'])
+
+
+if __name__ == '__main__':
+    unittest.main()
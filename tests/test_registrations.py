@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""test_registrations.py
+
+Tests of queued registration (ConferenceApi._drainRegistrations and
+_allocateTickets) on the App Engine testbed stubs.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import seats
+from conference import ConferenceApi
+from conference import REGISTRATION_QUEUE
+from models import Conference
+from models import Profile
+from models import Registration
+from models import RegistrationTicket
+
+
+class DrainRegistrationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=os.path.join(
+            os.path.dirname(__file__), '..'))
+        ndb.get_context().set_cache_policy(False)
+
+        self.conf = Conference(key=ndb.Key(Profile, 'organizer@example.com',
+                                           Conference, 1),
+                               name='Conference', maxAttendees=3,
+                               seatsAvailable=3, queuedRegistration=True)
+        ndb.put_multi([self.conf] + seats.createShards(self.conf, 3))
+        self.wsck = self.conf.key.urlsafe()
+
+        profiles = [Profile(key=ndb.Key(Profile, 'user%d@example.com' % i))
+                    for i in range(5)]
+        ndb.put_multi(profiles)
+        self.t_keys = ndb.put_multi([RegistrationTicket(
+            id='%s:%s' % (self.wsck, prof.key.id()), conference=self.conf.key,
+            profile=prof.key, status='QUEUED') for prof in profiles])
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def enqueue(self, t_keys):
+        taskqueue.Queue(REGISTRATION_QUEUE).add(
+            [taskqueue.Task(payload=t_key.urlsafe(), method='PULL',
+                            tag=self.wsck) for t_key in t_keys])
+
+    def statuses(self):
+        return sorted(t.status for t in ndb.get_multi(self.t_keys))
+
+    def assertAllocatedOnce(self):
+        shards = [s.seats for s in ndb.get_multi(seats.shardKeys(self.conf))]
+        self.assertEqual(sum(shards), 0)
+        self.assertTrue(min(shards) >= 0)
+        self.assertEqual(Registration.query().count(), 3)
+        self.assertEqual(self.statuses(),
+                         ['REGISTERED'] * 3 + ['SOLD_OUT'] * 2)
+
+    def testDrainingTwiceAllocatesOnce(self):
+        # every ticket queued twice, and handed out again after the
+        # first drain, as if its task had been delivered twice
+        self.enqueue(self.t_keys + self.t_keys)
+        ConferenceApi._drainRegistrations(self.wsck)
+        self.assertAllocatedOnce()
+
+        self.enqueue(self.t_keys)
+        ConferenceApi._drainRegistrations(self.wsck)
+        self.assertAllocatedOnce()
+        self.assertEqual(taskqueue.Queue(REGISTRATION_QUEUE).lease_tasks(
+            60, 100), [])
+
+    def testAllocatingTwiceAllocatesOnce(self):
+        ConferenceApi._allocateTickets(self.conf.key, self.t_keys)
+        ConferenceApi._allocateTickets(self.conf.key, self.t_keys)
+        self.assertAllocatedOnce()
+
+    def testRegisteredUserTakesNoSeat(self):
+        registered = ndb.get_multi(self.t_keys)[0]
+        Registration(key=ndb.Key(Registration, self.wsck,
+                                 parent=registered.profile),
+                     conference=self.conf.key).put()
+
+        ConferenceApi._allocateTickets(self.conf.key, self.t_keys)
+        self.assertEqual(self.statuses(), ['ALREADY_REGISTERED'] +
+                         ['REGISTERED'] * 3 + ['SOLD_OUT'])
+        self.assertEqual(Registration.query().count(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""test_schedule.py
+
+Tests of the wishlist schedule intervals (schedule.py): touching
+intervals don't overlap, nested ones do, and both lookups agree with
+checking every pair.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import schedule
+
+DAY = datetime(2016, 5, 1)
+
+
+def at(hour, minute=0):
+    return DAY + timedelta(hours=hour, minutes=minute)
+
+
+class Schedule(object):
+    """The lists of a WishlistSchedule, without the datastore."""
+
+    def __init__(self, intervals=()):
+        self.starts, self.ends, self.maxEnds, self.sessions = [], [], [], []
+        for key, start, end in intervals:
+            schedule.insert(self, key, start, end)
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def testTouchingIntervalsDontOverlap(self):
+        sched = Schedule([('a', at(9), at(10)), ('b', at(10), at(11))])
+        self.assertEqual(schedule.conflicts(sched), [])
+        self.assertEqual(schedule.overlapping(sched, at(10), at(11)), ['b'])
+        self.assertEqual(schedule.overlapping(sched, at(11), at(12)), [])
+        self.assertEqual(schedule.overlapping(sched, at(8), at(9)), [])
+        self.assertEqual(schedule.overlapping(sched, at(9, 59), at(10, 1)),
+                         ['a', 'b'])
+
+    def testNestedIntervalsOverlap(self):
+        # a long session with two inside it, the second ending with it
+        sched = Schedule([('outer', at(9), at(12)),
+                          ('first', at(10), at(11)),
+                          ('last', at(11), at(12))])
+        self.assertEqual(schedule.conflicts(sched),
+                         [('outer', 'first'), ('outer', 'last')])
+        self.assertEqual(schedule.overlapping(sched, at(10, 30), at(10, 45)),
+                         ['outer', 'first'])
+        self.assertEqual(schedule.overlapping(sched, at(8), at(13)),
+                         ['outer', 'first', 'last'])
+        # an earlier, longer interval is still found past shorter ones
+        sched = Schedule([('outer', at(8), at(18)),
+                          ('short', at(9), at(10))])
+        self.assertEqual(schedule.overlapping(sched, at(15), at(16)),
+                         ['outer'])
+
+    def testSameStart(self):
+        sched = Schedule([('a', at(9), at(10)), ('b', at(9), at(9, 30))])
+        self.assertEqual(schedule.conflicts(sched), [('a', 'b')])
+        self.assertEqual(schedule.overlapping(sched, at(9, 30), at(10)),
+                         ['a'])
+
+    def testRemoveKeepsRunningMaximum(self):
+        sched = Schedule([('outer', at(8), at(18)),
+                          ('short', at(9), at(10))])
+        schedule.remove(sched, 'outer')
+        self.assertEqual(sched.maxEnds, [at(10)])
+        self.assertEqual(schedule.overlapping(sched, at(15), at(16)), [])
+
+    def testAgreesWithEveryPair(self):
+        intervals = [('s%02d' % i, at(8, (i * 37) % 600),
+                      at(8, (i * 37) % 600 + (i * 13) % 90 + 1))
+                     for i in range(40)]
+        sched = Schedule(intervals)
+
+        def overlap(a, b):
+            return a[1] < b[2] and b[1] < a[2]
+
+        expected = set()
+        for i, a in enumerate(intervals):
+            for b in intervals[i + 1:]:
+                if overlap(a, b):
+                    expected.add(frozenset([a[0], b[0]]))
+        pairs = schedule.conflicts(sched)
+        self.assertEqual(len(pairs), len(expected))
+        self.assertEqual(set(frozenset(pair) for pair in pairs), expected)
+
+        for query in (('q', at(8), at(9)), ('q', at(10), at(10, 1)),
+                      ('q', at(12, 30), at(20))):
+            self.assertEqual(
+                set(schedule.overlapping(sched, query[1], query[2])),
+                set(a[0] for a in intervals if overlap(a, query)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""test_seats.py
+
+Tests of the sharded seat counter (seats.py) on the App Engine testbed
+stubs.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import seats
+from models import Conference
+from models import Profile
+from models import RegistrationTicket
+
+
+class SeatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=os.path.join(
+            os.path.dirname(__file__), '..'))
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def conference(self, maxAttendees):
+        conf = Conference(key=ndb.Key(Profile, 'organizer@example.com',
+                                      Conference, 1),
+                          name='Conference', maxAttendees=maxAttendees,
+                          seatsAvailable=maxAttendees)
+        ndb.put_multi([conf] + seats.createShards(conf, maxAttendees))
+        return conf
+
+    def shardSeats(self, conf):
+        return [shard.seats for shard in ndb.get_multi(seats.shardKeys(conf))]
+
+    def testTakeSeatStopsAtZero(self):
+        conf = self.conference(3)
+        taken = [seats.takeSeat(conf) for i in range(5)]
+        self.assertEqual(taken, [True, True, True, False, False])
+        self.assertEqual(self.shardSeats(conf), [0, 0, 0])
+
+    def testDeclinedCallbackTakesNoSeat(self):
+        conf = self.conference(3)
+        self.assertFalse(seats.takeSeat(conf, lambda: False))
+        self.assertEqual(sum(self.shardSeats(conf)), 3)
+
+    def testTakeSeatsForClaimsAtMostFreeSeats(self):
+        conf = self.conference(10)
+        tickets = [RegistrationTicket(id='t%d' % i, status='QUEUED')
+                   for i in range(30)]
+        keys = ndb.put_multi(tickets)
+
+        def claim(entities, free):
+            entities = [e for e in entities if e.status == 'QUEUED'][:free]
+            for ticket in entities:
+                ticket.status = 'ALLOCATED'
+            return entities
+
+        claimed = seats.takeSeatsFor(conf, keys, claim)
+        self.assertEqual(len(claimed), 10)
+        self.assertEqual(sum(self.shardSeats(conf)), 0)
+        self.assertTrue(min(self.shardSeats(conf)) >= 0)
+        self.assertEqual(
+            sum(1 for t in ndb.get_multi(keys) if t.status == 'ALLOCATED'),
+            10)
+        # nothing left to give
+        self.assertEqual(seats.takeSeatsFor(conf, keys, claim), [])
+
+    def testAdjustSeats(self):
+        conf = self.conference(4)
+        seats.takeSeat(conf)
+        seats.takeSeat(conf)
+
+        self.assertTrue(seats.adjustSeats(conf.key, 3))
+        self.assertEqual(sum(self.shardSeats(conf)), 5)
+        self.assertTrue(seats.adjustSeats(conf.key, -4))
+        self.assertEqual(sum(self.shardSeats(conf)), 1)
+
+    def testAdjustBelowTakenIsRejected(self):
+        conf = self.conference(4)
+        seats.takeSeat(conf)
+        seats.takeSeat(conf)
+
+        self.assertFalse(seats.adjustSeats(conf.key, -3))
+        self.assertEqual(sum(self.shardSeats(conf)), 2)
+        self.assertTrue(min(self.shardSeats(conf)) >= 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
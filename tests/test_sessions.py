@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""test_sessions.py
+
+Tests of batch session creation on the App Engine testbed stubs.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from conference import FEATURED_SPEAKER_ID
+from conference import MAX_SESSIONS_PER_BATCH
+from models import Conference
+from models import FeaturedSpeaker
+from models import Profile
+from models import Session
+from models import SessionForm
+from models import SpeakerSessionCount
+
+MAX_ENTITIES_PER_COMMIT = 500   # datastore limit
+
+
+class PutSessionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=os.path.join(
+            os.path.dirname(__file__), '..'))
+        self.testbed.init_search_stub()
+        ndb.get_context().set_cache_policy(False)
+
+        self.c_key = ndb.Key(Profile, 'organizer@example.com',
+                             Conference, 1)
+        Conference(key=self.c_key, name='Conference').put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testMaximumBatchCommits(self):
+        # worst case: a speaker already on the programme (so there's a
+        # new featured speaker) and every other session by a new speaker
+        ConferenceApi._putSessions(
+            self.c_key, [SessionForm(name='Opening', speaker='Speaker 0')])
+
+        written = []
+
+        def countPuts(service, call, request, response):
+            if service == 'datastore_v3' and call == 'Put':
+                written.append(request.entity_size())
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_puts', countPuts)
+
+        forms = [SessionForm(name='Session %d' % i, speaker='Speaker %d' % i)
+                 for i in range(MAX_SESSIONS_PER_BATCH)]
+        sessions = ConferenceApi._putSessions(self.c_key, forms)
+
+        self.assertEqual(len(sessions), MAX_SESSIONS_PER_BATCH)
+        self.assertEqual(sum(written), 2 * MAX_SESSIONS_PER_BATCH + 1)
+        self.assertTrue(sum(written) <= MAX_ENTITIES_PER_COMMIT)
+        self.assertEqual(Session.query(ancestor=self.c_key).count(),
+                         MAX_SESSIONS_PER_BATCH + 1)
+        self.assertEqual(
+            SpeakerSessionCount.query(ancestor=self.c_key).count(),
+            MAX_SESSIONS_PER_BATCH)
+        featured = ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                           parent=self.c_key).get()
+        self.assertEqual(featured.speaker, 'Speaker 0')
+
+
+if __name__ == '__main__':
+    unittest.main()
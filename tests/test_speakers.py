@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""test_speakers.py
+
+Tests of the cross-conference speaker index (speakers.py) on the App
+Engine testbed stubs.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import speakers
+from models import Conference
+from models import Profile
+from models import Session
+
+C_KEY = ndb.Key(Profile, 'organizer@example.com', Conference, 1)
+
+
+class SpeakersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+        self.sessions = {}
+        for s_id, speaker in enumerate(['John Smith', 'J. Smith',
+                                        'Jane Smith', u'Jos\xe9 Smith'], 1):
+            session = Session(key=ndb.Key(Session, s_id, parent=C_KEY),
+                              name='Session %d' % s_id, speaker=speaker)
+            self.sessions[speaker] = session.put()
+        speakers.indexSessions(ndb.get_multi(self.sessions.values()))
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def found(self, name):
+        return set(speakers.sessionKeys(name))
+
+    def testInitialsFindFullNames(self):
+        self.assertEqual(self.found('j smith'), set(self.sessions.values()))
+
+    def testFullNameFindsInitials(self):
+        self.assertEqual(self.found('John Smith'),
+                         set([self.sessions['John Smith'],
+                              self.sessions['J. Smith']]))
+        self.assertEqual(self.found('jose  SMITH!'),
+                         set([self.sessions[u'Jos\xe9 Smith'],
+                              self.sessions['J. Smith']]))
+
+    def testIndexingTwiceAddsNothing(self):
+        speakers.indexSessions(ndb.get_multi(self.sessions.values()))
+        self.assertEqual(speakers.sessionKeys('John Smith'),
+                         [self.sessions['John Smith'],
+                          self.sessions['J. Smith']])
+
+    def testUnknownOrEmpty(self):
+        self.assertEqual(self.found('Ada Lovelace'), set())
+        self.assertEqual(self.found(' . '), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""test_utils.py
+
+Tests of the cached tokeninfo lookup in utils.py, against a urlfetch
+service stub that answers from a list of canned responses.
+
+Run from the project root with the App Engine SDK on PYTHONPATH:
+    python -m unittest discover tests
+
+"""
+
+import hashlib
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import urlfetch_service_pb
+from google.appengine.ext import testbed
+from google.appengine.runtime import apiproxy_errors
+
+import utils
+
+TOKEN = 'token-1'
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content=''):
+        self.status_code = status_code
+        self.content = content
+
+
+class CannedFetchStub(apiproxy_stub.APIProxyStub):
+    """urlfetch service answering each Fetch with the next response, a
+    FakeResponse or an application error code to fail with."""
+
+    def __init__(self):
+        super(CannedFetchStub, self).__init__('urlfetch')
+        self.responses = []
+        self.fetched = []
+
+    def _Dynamic_Fetch(self, request, response):
+        self.fetched.append(request.url())
+        canned = self.responses.pop(0)
+        if isinstance(canned, int):
+            raise apiproxy_errors.ApplicationError(canned)
+        response.set_statuscode(canned.status_code)
+        response.set_content(canned.content)
+
+
+class LeaderDone(object):
+    """Stands in for the Event of an in-flight lookup; finish() runs as
+    the follower starts waiting."""
+
+    def __init__(self, finish):
+        self.finish = finish
+
+    def wait(self, timeout=None):
+        self.finish()
+        return True
+
+
+def ok(userId, expiresIn=600):
+    return FakeResponse(200, json.dumps({'user_id': userId,
+                                         'expires_in': expiresIn}))
+
+
+class LookupUserIdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.urlfetch = CannedFetchStub()
+        apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', self.urlfetch)
+        self.fetched = self.urlfetch.fetched
+        utils.clearTokenCache()
+
+        # retries go out right away; sleeping would hold the request
+        self.slept = []
+        self._sleep = utils.time.sleep
+        utils.time.sleep = self.slept.append
+
+    def tearDown(self):
+        utils.time.sleep = self._sleep
+        utils.clearTokenCache()
+        self.testbed.deactivate()
+
+    def respond(self, *responses):
+        self.urlfetch.responses = list(responses)
+
+    def testMissFetchesAndCaches(self):
+        self.respond(ok('42'))
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '42')
+        self.assertEqual(len(self.fetched), 1)
+
+    def testHitSkipsFetch(self):
+        self.respond(ok('42'))
+        utils._lookupUserId(TOKEN, 'id_token')
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '42')
+        # and from memcache once the local cache is gone
+        utils.clearTokenCache()
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '42')
+        self.assertEqual(len(self.fetched), 1)
+
+    def testServerErrorsRetryAtOnce(self):
+        self.respond(FakeResponse(503),
+                     urlfetch_service_pb.URLFetchServiceError.
+                     DEADLINE_EXCEEDED,
+                     ok('42'))
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '42')
+        self.assertEqual(len(self.fetched), 3)
+        self.assertEqual(self.slept, [])
+
+    def testGivesUpAfterLastAttempt(self):
+        self.respond(*[FakeResponse(500)] * utils.TOKENINFO_ATTEMPTS)
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '')
+        self.assertEqual(len(self.fetched), utils.TOKENINFO_ATTEMPTS)
+        self.assertEqual(self.slept, [])
+
+    def testClientErrorIsNotRetried(self):
+        self.respond(FakeResponse(403), ok('42'))
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '')
+        self.assertEqual(len(self.fetched), 1)
+
+    def testInvalidIdTokenRetriedAsAccessToken(self):
+        self.respond(FakeResponse(400, '{"error": "invalid_token"}'),
+                     ok('42'))
+        self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'), '42')
+        self.assertTrue('access_token=' in self.fetched[1])
+        self.assertEqual(self.slept, [])
+
+    def testFollowerWaitsForLeader(self):
+        tokenHash = hashlib.sha256(TOKEN).hexdigest()
+
+        for cached, expected in ((False, ''), (True, '42')):
+            # another request is fetching this token; it finishes,
+            # caching the user id or not, while this one waits on it
+            utils._inflight[tokenHash] = LeaderDone(
+                lambda: cached and utils._remember(
+                    tokenHash, ('42', utils.time.time() + 60)))
+            try:
+                self.assertEqual(utils._lookupUserId(TOKEN, 'id_token'),
+                                 expected)
+            finally:
+                del utils._inflight[tokenHash]
+            utils.clearTokenCache()
+        self.assertEqual(self.fetched, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,118 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_DEADLINE = 5          # seconds for all attempts together
+TOKEN_CACHE_SIZE = 1000         # tokens kept per instance
+TOKEN_CACHE_MAX_TTL = 3600      # seconds
+MEMCACHE_TOKEN_KEY = "TOKEN_USER_ID:%s"
+
+_tokenCache = OrderedDict()     # token hash -> (user id, expiry time)
+_inflight = {}                  # token hash -> Event set when looked up
+_lock = threading.Lock()
+
+
+def _cachedUserId(tokenHash):
+    """Return the cached user id for a token hash, or None."""
+    with _lock:
+        entry = _tokenCache.pop(tokenHash, None)
+        if entry and entry[1] > time.time():
+            _tokenCache[tokenHash] = entry      # most recently used
+            return entry[0]
+    entry = memcache.get(MEMCACHE_TOKEN_KEY % tokenHash)
+    if entry and entry[1] > time.time():
+        _remember(tokenHash, entry)
+        return entry[0]
+    return None
+
+
+def _remember(tokenHash, entry):
+    """Keep a (user id, expiry time) entry in the local LRU."""
+    with _lock:
+        _tokenCache.pop(tokenHash, None)
+        _tokenCache[tokenHash] = entry
+        while len(_tokenCache) > TOKEN_CACHE_SIZE:
+            _tokenCache.popitem(last=False)
+
+
+def clearTokenCache():
+    """Forget every locally cached token (memcache is left alone)."""
+    with _lock:
+        _tokenCache.clear()
+
+
+def _fetchTokenInfo(token, token_type):
+    """Ask the tokeninfo endpoint about token, retrying without sleeping
+    within an overall deadline; returns the decoded response or {}.
+    Fetch errors and 5xx responses are retried while time remains; an
+    id_token the endpoint rejects is retried as an access_token.
+    """
+    give_up = time.time() + TOKENINFO_DEADLINE
+    for i in range(TOKENINFO_ATTEMPTS):
+        remaining = give_up - time.time()
+        if remaining <= 0:
+            break
+        rpc = urlfetch.create_rpc(deadline=remaining)
+        urlfetch.make_fetch_call(rpc, TOKENINFO_URL % (token_type, token))
+        try:
+            resp = rpc.get_result()
+        except urlfetch.Error:
+            resp = None
+        if resp is not None and resp.status_code == 200:
+            return json.loads(resp.content)
+        if resp is not None and resp.status_code < 500:
+            invalid = (resp.status_code == 400 and
+                       'invalid_token' in resp.content)
+            if not invalid or token_type == 'access_token':
+                break
+            token_type = 'access_token'
+    return {}
+
+
+def _lookupUserId(token, token_type):
+    """Resolve token to a user id, through the caches; concurrent
+    lookups of one token on this instance share a single fetch.
+    """
+    tokenHash = hashlib.sha256(token).hexdigest()
+    userId = _cachedUserId(tokenHash)
+    if userId:
+        return userId
+
+    with _lock:
+        done = _inflight.get(tokenHash)
+        leader = done is None
+        if leader:
+            done = _inflight[tokenHash] = threading.Event()
+    if not leader:
+        done.wait(TOKENINFO_DEADLINE)
+        return _cachedUserId(tokenHash) or ''
+
+    try:
+        info = _fetchTokenInfo(token, token_type)
+        userId = info.get('user_id', '')
+        if userId:
+            ttl = min(int(info.get('expires_in', 0)), TOKEN_CACHE_MAX_TTL)
+            if ttl > 0:
+                entry = (userId, time.time() + ttl)
+                memcache.set(MEMCACHE_TOKEN_KEY % tokenHash, entry, time=ttl)
+                _remember(tokenHash, entry)
+        return userId
+    finally:
+        with _lock:
+            del _inflight[tokenHash]
+        done.set()
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -17,22 +124,7 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _lookupUserId(token, token_type)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm